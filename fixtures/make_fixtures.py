@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from patron_loading_transform import FILTER_COLUMNS, REQUIRED_COLUMNS  # noqa: E402
+
+# Synthetic regression fixtures: no real student data. Regenerate with
+#   python fixtures/make_fixtures.py
+# then refresh the goldens with
+#   python patron_loading_transform.py regression fixtures --update
+
+FIXTURES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Latin-1 accents, characters Latin-1 cannot hold, and the characters the TXT writer escapes.
+FIRST_NAMES = ['Zoë', 'José', 'Nguyễn', 'Łukasz', '李', 'O’Brien', 'Mary "Mae"', 'Tab\there', 'Back\\slash', ' Padded ']
+EMAILS = ['{n}@example.edu.au', 'no-at-sign.example.edu.au', 'b@b', '', ' {n}@EXAMPLE.edu.au ']
+INSTITUTIONS = [
+    ('University of Divinity', 'UD'), ('Catholic Theological College', 'CTC'), ('Whitley College', 'WHT'),
+    ('Pilgrim Theological College', 'PIL'), ('Trinity College Theological School', 'TRI'),
+    ('Nowhere College', 'ZZZ'), (' Yarra Theological Union ', ''),
+]
+
+def report_rows(count: int) -> pd.DataFrame:
+    rows = []
+    for i in range(count):
+        name, abbrev = INSTITUTIONS[i % len(INSTITUTIONS)]
+        row = dict.fromkeys(list(dict.fromkeys(REQUIRED_COLUMNS + FILTER_COLUMNS)), '')
+        row.update({
+            'First Name': FIRST_NAMES[i % len(FIRST_NAMES)],
+            'Last Name': f"Student{i:03d}" + (' Jr.' if i % 9 == 0 else ''),
+            'Student Number': f"S{i:07d}" if i % 8 else '',
+            'Email': EMAILS[i % len(EMAILS)].format(n=f"s{i:03d}"),
+            'Course Type': ['Research', 'Coursework', ''][i % 3],
+            'Student Home Institution Abbrev': abbrev,
+            'Student Home Institution Name': name,
+            'Address1': '1 "Main" St\tUnit 2' if i % 6 == 0 else f"{i} Church St",
+            'City': 'Melbourne', 'State': 'VIC', 'Postal Code': '3000', 'Country': 'Australia',
+            'Course Name': 'Master of Divinity',
+            'Person Status Id': 'PERSON_INACTIVE' if i % 10 == 4 else 'PERSON_ACTIVE',
+            'Course Status Id': 'PROGRAM_LAPSED' if i % 11 == 5 else 'PROGRAM_ACTIVE',
+            'Enrolment Status Id': ' ENROLMENT_WITHDRAWN' if i % 13 == 6 else 'ENROLMENT_ENROLLED ',
+        })
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def secondary_audit() -> pd.DataFrame:
+    # An audit export: one Name column, aliased headers, loose status and college spellings.
+    return pd.DataFrame({
+        'Name': ['Smith, Zoë', 'José María García', 'Nguyễn Văn An', '', 'Mary "Mae" O’Brien', 'Lee'],
+        'Barcode': ['P0000001', 'P0000002', '', '', 'P0000005', 'P0000006'],
+        'emailAddress': ['zoe@example.edu.au', 'bad-email', 'an@example.edu.au', 'only@example.edu.au', '', ''],
+        'Home College': ['pilgrim', 'Trinity', 'TRI', '', 'Nowhere College', 'pil'],
+        'Course': ['MDiv', 'MTh', '', '', 'MDiv', 'BTh'],
+        'personStatus': ['active', 'PERSON_ACTIVE', '', 'current', 'active', 'inactive'],
+        'Enrolment status': ['enrolled', '', 'ENROLMENT_ENROLLED', '', 'enrolled', 'enrolled'],
+    })
+
+def minimal_audit() -> pd.DataFrame:
+    # Only names and barcodes: every status and the college fall back to the secondary defaults.
+    return pd.DataFrame({
+        'Name': ['Smith, Jo', 'Ana Łopez', '', 'Mary Ann Lee'],
+        'Barcode': ['P1000001', 'P1000002', 'P1000003', ''],
+    })
+
+def patron_names() -> pd.DataFrame:
+    # The patron-template XLSX the app merges into primary data.
+    return pd.DataFrame({
+        'givenName': ['Zoë', 'Łukasz', '', 'Back\\slash'],
+        'familyName': ['Import', 'Kowalski', '', 'Import'],
+        'barcode': ['X0000001', 'X0000002', 'X0000003', 'X0000004'],
+        'emailAddress': ['zoe.import@example.edu.au', 'no-at-sign', 'blank@example.edu.au', ''],
+        'Student Home Institution Name': ['', 'Pilgrim Theological College', '', 'Whitley College'],
+    })
+
+if __name__ == '__main__':
+    report_rows(60).to_csv(os.path.join(FIXTURES_DIR, 'report_standard.csv'), index=False)
+    secondary_audit().to_csv(os.path.join(FIXTURES_DIR, 'secondary_audit.csv'), index=False)
+    minimal_audit().to_csv(os.path.join(FIXTURES_DIR, 'pilgrim_minimal.csv'), index=False)
+    patron_names().to_excel(os.path.join(FIXTURES_DIR, 'patron_names.xlsx'), index=False)
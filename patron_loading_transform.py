@@ -1,9 +1,29 @@
-import streamlit as st
 import pandas as pd
+import numpy as np
+import argparse
+import bisect
 import csv
+import fnmatch
+import functools
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import random
 import re
-from datetime import date
-from typing import List, Tuple
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
 
 # ---------------- Constants ---------------- #
 
@@ -35,6 +55,41 @@ SECONDARY_IMPORT_DEFAULTS = {
     'Enrolment Status Id': 'ENROLMENT_ENROLLED',
     'Student Home Institution Name': 'Pilgrim Theological College'
 }
+# Support both source CSV headers and patron-template XLSX headers.
+PRIMARY_IMPORT_ALIASES: Dict[str, List[str]] = {
+    'First Name': ['First', 'givenName'],
+    'Middle Name': ['middleName'],
+    'Last Name': ['Last', 'Surname', 'familyName'],
+    'Nickname': ['nickname'],
+    'Student Number': ['barcode'],
+    'Email': ['emailAddress', 'username', 'idAtSource'],
+    'Address1': ['primaryStreetAddressLine1'],
+    'Address2': ['primaryStreetAddressLine2'],
+    'City': ['primaryCityOrLocality'],
+    'State': ['primaryStateOrProvince'],
+    'Postal Code': ['primaryPostalCode'],
+    'Country': ['primaryCountry'],
+    'Home Phone': ['primaryPhone'],
+    'Work Phone': ['secondaryPhone'],
+    'Mobile Phone': ['mobilePhone'],
+    'Course Level': ['customdata1'],
+    'Course Name': ['customdata2'],
+    'Course Type': ['customdata3'],
+    'Student Home Institution Name': ['patronNotes']
+}
+SECONDARY_IMPORT_ALIASES: Dict[str, List[str]] = {
+    'First Name': ['First', 'givenName'],
+    'Middle Name': ['Middle', 'middleName'],
+    'Last Name': ['Last', 'Surname', 'familyName'],
+    'Student Number': ['Barcode', 'barcode'],
+    'Email': ['emailAddress', 'username', 'idAtSource'],
+    'Course Name': ['Course', 'customdata2'],
+    'Course Type': ['Course Type', 'customdata3'],
+    'Student Home Institution Name': ['Home College', 'College', 'patronNotes'],
+    'Person Status Id': ['Person Status Id', 'personStatus'],
+    'Course Status Id': ['Course Status Id', 'courseStatus'],
+    'Enrolment Status Id': ['Enrolment status', 'Enrollment status', 'Enrolment Status Id']
+}
 INSTITUTION_ABBREV_BY_NAME = {
     'Australian Lutheran College': 'ALC',
     'Catholic Theological College': 'CTC',
@@ -74,6 +129,47 @@ ALLOWED_INSTITUTIONS_SECONDARY = (
     'Trinity College Theological School'
 )
 
+# Bit flags for the filter rule(s) a row failed; 0 means the row was kept.
+REJECT_PERSON_STATUS = 1
+REJECT_COURSE_STATUS = 2
+REJECT_ENROLMENT_STATUS = 4
+REJECT_INSTITUTION = 8
+REJECTION_REASONS: Dict[int, str] = {
+    REJECT_PERSON_STATUS: 'Person status',
+    REJECT_COURSE_STATUS: 'Course status',
+    REJECT_ENROLMENT_STATUS: 'Enrolment status',
+    REJECT_INSTITUTION: 'Institution group'
+}
+REJECTION_CODE_COLUMN = 'Rejection Code'
+REJECTION_REASON_COLUMN = 'Rejection Reasons'
+REJECTION_SOURCE_COLUMN = 'Source File'
+
+# Row lineage packed into one int64 per row, high to low bits:
+# transfer action | source id | source file id | source row number.
+LINEAGE_COLUMN = '__lineage'
+LINEAGE_ROW_BITS = 32
+LINEAGE_FILE_BITS = 16
+LINEAGE_SOURCE_BITS = 4
+LINEAGE_SOURCE_REPORT = 1
+LINEAGE_SOURCE_XLSX = 2
+LINEAGE_SOURCE_MANUAL = 3
+LINEAGE_SOURCE_TRANSFER = 4
+LINEAGE_SOURCES: Dict[int, str] = {
+    LINEAGE_SOURCE_REPORT: 'Report CSV',
+    LINEAGE_SOURCE_XLSX: 'XLSX import',
+    LINEAGE_SOURCE_MANUAL: 'Manual name',
+    LINEAGE_SOURCE_TRANSFER: 'Manual transfer'
+}
+LINEAGE_ACTION_NONE = 0
+LINEAGE_ACTION_ADDED = 1
+LINEAGE_ACTION_UPDATED = 2
+LINEAGE_ACTIONS: Dict[int, str] = {
+    LINEAGE_ACTION_NONE: 'none',
+    LINEAGE_ACTION_ADDED: 'added',
+    LINEAGE_ACTION_UPDATED: 'updated'
+}
+LINEAGE_REPORT_COLUMNS = ['Source', 'Source File', 'Source Row', 'Transfer Action']
+
 HOME_BRANCH_MAPPING = {
     'ALC': '267183', 'CTC': '266990', 'SAC': '266992', 'YTU': '266993',
     'UCLT': '270309', 'UD': '267183', 'WHT': '271609', 'WTC': '94194',
@@ -112,7 +208,45 @@ FIELD_ORDER: List[str] = [
     "username", "illId", "illApprovalStatus", "illPatronType", "illPickupLocation"
 ]
 
+# Output template: FIELD_ORDER slots copied from a source column, derived per row,
+# or constant. Every other slot is always empty.
+OUTPUT_COLUMN_FIELDS: Dict[str, str] = {
+    'givenName': 'First Name',
+    'middleName': 'Middle Name',
+    'familyName': 'Last Name',
+    'nickname': 'Nickname',
+    'barcode': 'Student Number',
+    'idAtSource': 'Email',
+    'primaryStreetAddressLine1': 'Address1',
+    'primaryStreetAddressLine2': 'Address2',
+    'primaryCityOrLocality': 'City',
+    'primaryStateOrProvince': 'State',
+    'primaryPostalCode': 'Postal Code',
+    'primaryCountry': 'Country',
+    'primaryPhone': 'Home Phone',
+    'secondaryPhone': 'Work Phone',
+    'emailAddress': 'Email',
+    'mobilePhone': 'Mobile Phone',
+    'patronNotes': 'Student Home Institution Name',
+    'customdata1': 'Course Level',
+    'customdata2': 'Course Name',
+    'customdata3': 'Course Type',
+    'username': 'Email'
+}
+OUTPUT_DERIVED_FIELDS: Tuple[str, ...] = ('borrowerCategory', 'homeBranch', 'photoURL')
+OUTPUT_CONSTANT_FIELDS: Dict[str, object] = {
+    'canSelfEdit': False,
+    'institutionId': "134059",
+    'sourceSystem': "https://idp.divinity.edu.au/realms/divinity"
+}
+OUTPUT_SOURCE_COLUMNS: List[str] = list(dict.fromkeys(
+    list(OUTPUT_COLUMN_FIELDS.values()) + ['Course Type', 'Student Home Institution Abbrev']
+))
+
 EMAIL_REGEX = re.compile(r"^[^@]+@[^@]+\.[^@]+$")
+TRANSFER_TOKEN_REGEX = re.compile(r"\w+")
+TRANSFER_PAGE_SIZE = 50
+TRANSFER_SELECTION_STATE = 'transfer-selection'
 DEFAULT_EXPIRATION_DATE = date(2026, 12, 31)
 EXPIRATION_DATE_FORMAT = "%Y-%m-%dT00:00:00"
 DEFAULT_HOME_BRANCH = HOME_BRANCH_MAPPING.get('UD', '')
@@ -122,6 +256,102 @@ DEFAULT_SECONDARY_ABBREV = INSTITUTION_ABBREV_BY_NAME.get(DEFAULT_SECONDARY_INST
 
 CSV_ROLE_STANDARD = "Standard report (split primary + secondary)"
 CSV_ROLE_SECONDARY_ONLY = "Secondary import only (Pilgrim/Trinity audit)"
+SECONDARY_OUTPUT_OVERRIDES = {
+    'institutionId': '51546',
+    'borrowerCategory': 'Home Colleges',
+    'homeBranch': '266145'
+}
+OUTPUT_PROFILES: Dict[str, Dict[str, str]] = {
+    'primary': {},
+    'secondary': SECONDARY_OUTPUT_OVERRIDES
+}
+OUTPUT_ENCODING = 'latin-1'
+NON_LATIN1_PATTERN = r'[^\x00-\xff]'
+# Common characters outside ISO-8859-1 that Unicode decomposition does not reduce.
+LATIN1_TRANSLITERATIONS: Dict[str, str] = {
+    '\u2018': "'", '\u2019': "'", '\u201a': "'", '\u201b': "'", '\u2032': "'",
+    '\u201c': '"', '\u201d': '"', '\u201e': '"', '\u201f': '"', '\u2033': '"',
+    '\u2010': '-', '\u2011': '-', '\u2012': '-', '\u2013': '-', '\u2014': '-', '\u2212': '-',
+    '\u2026': '...', '\u2022': '*', '\u20ac': 'EUR',
+    '\u0110': 'D', '\u0111': 'd', '\u0141': 'L', '\u0142': 'l', '\u0131': 'i',
+    '\u0152': 'OE', '\u0153': 'oe', '\u0126': 'H', '\u0127': 'h', '\u0166': 'T', '\u0167': 't'
+}
+ENCODING_AUDIT_COLUMNS = ['Row', 'Field', 'Original', 'Transliterated']
+# Characters the TXT writer escapes with a backslash (csv.QUOTE_NONE semantics).
+OUTPUT_ESCAPE_CHARS = '\t"\\' + os.linesep
+OUTPUT_ESCAPE_REGEX = re.compile('[' + re.escape(OUTPUT_ESCAPE_CHARS) + ']')
+OUTPUT_RENDER_BLOCK_ROWS = 8192
+OUTPUT_PREVIEW_ROWS = 1000
+SHARD_UNASSIGNED = 'UNASSIGNED'
+SHARD_KEY_PATTERN = r'[A-Za-z0-9_-]+'
+SHARD_MIN_CHUNK_ROWS = 5000
+PART_NUMBER_DIGITS = 3
+PART_WRITE_WORKERS = 8
+
+BACKEND_ENV = 'PATRON_BACKEND'
+DEFAULT_BACKEND = 'pandas'
+
+# Join keys in priority order; each pass only sees rows earlier passes left unmatched.
+RECONCILE_KEYS: List[Tuple[str, str]] = [
+    ('Student Number', '__number_key'),
+    ('Email', '__email_key'),
+    ('Name', '__name_key')
+]
+RECONCILE_FIELDS: List[str] = [
+    'First Name', 'Middle Name', 'Last Name', 'Student Number', 'Email',
+    'Course Name', 'Course Type', 'Student Home Institution Name', 'Student Home Institution Abbrev'
+]
+# Fields compared on their match key, so case alone is not reported as a difference.
+RECONCILE_COMPARE_KEYS: Dict[str, str] = {
+    'Student Number': '__number_key',
+    'Email': '__email_key'
+}
+RECONCILE_OUTPUTS: Dict[str, str] = {
+    'matched': 'reconcile_matched.csv',
+    'only_in_audit': 'reconcile_only_in_audit.csv',
+    'only_in_report': 'reconcile_only_in_report.csv',
+    'differences': 'reconcile_differences.csv'
+}
+RECONCILE_SUMMARY_OUTPUT = 'reconcile_summary.json'
+
+REGRESSION_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+REGRESSION_GOLDEN_DIR = 'golden'
+PARITY_SHARD_WORKERS = 2
+REGRESSION_BASELINE_FILE = 'baseline.json'
+REGRESSION_TOLERANCE = 0.25
+REGRESSION_MIN_SLACK_SECONDS = 0.05
+
+CHECKPOINT_VERSION = 2
+CHECKPOINT_STAGES: Tuple[str, ...] = ('filtered', 'transformed')
+CHECKPOINT_MANIFEST_SUFFIX = '_checkpoint.json'
+COLUMNAR_COMPRESSION = 'zstd'
+
+WATCH_STATE_FILE = '.watch_state.json'
+WATCH_POLL_SECONDS = 30.0
+WATCH_SETTLE_SECONDS = 2.0
+WATCH_SECONDARY_PATTERNS: Tuple[str, ...] = ('*audit*', '*pilgrim*', '*trinity*', '*secondary*')
+
+BATCH_ROLE_PRIMARY_IMPORT = "Primary import (XLSX names)"
+BATCH_PRIMARY_OUTPUT = 'transformed_data_primary.txt'
+BATCH_SECONDARY_OUTPUT = 'transformed_data_secondary.txt'
+BATCH_REPORT_OUTPUT = 'batch_report.json'
+BATCH_REJECTED_OUTPUT = 'rejected_rows.csv'
+BATCH_CHECKPOINT_STEM = 'batch'
+
+UPLOAD_STATE_FILE = '.upload_state.json'
+UPLOAD_CONCURRENCY = 4
+UPLOAD_MAX_ATTEMPTS = 5
+UPLOAD_BACKOFF_SECONDS = 0.5
+UPLOAD_TIMEOUT_SECONDS = 60.0
+UPLOAD_RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+UPLOAD_TOKEN_ENV = 'OCLC_INGEST_TOKEN'
+MOCK_INGEST_PORT = 8765
+
+STAGE_CACHE_MB_ENV = 'PATRON_CACHE_MAX_MB'
+STAGE_CACHE_DEFAULT_MB = 512
+
+IMPORT_BUDGET_SECONDS = 1.5
+IMPORT_BENCH_RUNS = 5
 APP_CSS = """
 <style>
 :root {
@@ -238,31 +468,308 @@ div[data-testid="stAlert"] {
 </style>
 """
 
+# ---------------- App Runtime ---------------- #
+
+logger = logging.getLogger(__name__)
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+
+def streamlit_active() -> bool:
+    # Only `streamlit run` has imported Streamlit and started a runtime;
+    # headless callers never pay for the import.
+    streamlit = sys.modules.get('streamlit')
+    return streamlit is not None and streamlit.runtime.exists()
+
+_warning_captures = threading.local()
+
+def show_warning(message: str) -> None:
+    captures = getattr(_warning_captures, 'stack', None)
+    if captures:
+        captures[-1].append(message)
+    if streamlit_active():
+        import streamlit as st
+        st.warning(message)
+    else:
+        logger.warning(message)
+
+def stop_with_error(message: str) -> None:
+    if streamlit_active():
+        import streamlit as st
+        st.error(message)
+        st.stop()
+    raise ValueError(message)
+
+# ---------------- Stage Cache ---------------- #
+
+_CACHE_MISS = object()
+
+def update_cache_digest(digest, value) -> None:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        columns = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+        dtypes = list(value.dtypes) if isinstance(value, pd.DataFrame) else [value.dtype]
+        digest.update(repr((type(value).__name__, columns, [str(d) for d in dtypes])).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, (tuple, list)):
+        digest.update(f"{type(value).__name__}:{len(value)}".encode('utf-8'))
+        for item in value:
+            update_cache_digest(digest, item)
+    else:
+        digest.update(repr(value).encode('utf-8'))
+
+def build_cache_key(name: str, args: tuple, kwargs: dict) -> str:
+    digest = hashlib.sha256(name.encode('utf-8'))
+    update_cache_digest(digest, args)
+    update_cache_digest(digest, sorted(kwargs.items()))
+    return digest.hexdigest()
+
+def estimate_cache_bytes(value) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_cache_bytes(item) for item in value)
+    return sys.getsizeof(value)
+
+def copy_cached_value(value):
+    # Callers mutate stage results (e.g. secondary overrides), so hand out copies.
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(copy_cached_value(item) for item in value)
+    return value
+
+class StageCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, Tuple[object, List[str], int]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return _CACHE_MISS, []
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key: str, value, warnings: List[str]) -> None:
+        size = estimate_cache_bytes(value)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[2]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, warnings, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+def build_stage_cache() -> StageCache:
+    return StageCache(int(float(os.environ.get(STAGE_CACHE_MB_ENV, STAGE_CACHE_DEFAULT_MB)) * 1024 * 1024))
+
+def get_stage_cache() -> StageCache:
+    # `streamlit run` re-executes this module on every rerun, so a module-level cache
+    # would start empty each time; cache_resource keeps one per server process,
+    # shared by every session.
+    import streamlit as st
+    return st.cache_resource(show_spinner=False)(build_stage_cache)()
+
+def cached_stage(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Headless runs see each input once, so they skip hashing and retention.
+        if not streamlit_active():
+            return func(*args, **kwargs)
+
+        key = build_cache_key(func.__qualname__, args, kwargs)
+        stage_cache = get_stage_cache()
+        value, warnings = stage_cache.get(key)
+        if value is _CACHE_MISS:
+            captures = getattr(_warning_captures, 'stack', None)
+            if captures is None:
+                captures = _warning_captures.stack = []
+            captures.append([])
+            try:
+                value = func(*args, **kwargs)
+            finally:
+                warnings = captures.pop()
+            stage_cache.put(key, value, warnings)
+            if captures:
+                captures[-1].extend(warnings)
+        else:
+            # Replay warnings from the original run, as st.cache_data did.
+            for message in warnings:
+                show_warning(message)
+        return copy_cached_value(value)
+    return wrapper
+
 # ---------------- Data Transformation ---------------- #
 
-@st.cache_data(show_spinner=False)
-def apply_filters(raw_data: pd.DataFrame, allowed_institutions: Tuple[str, ...]) -> pd.DataFrame:
+def clean_filter_columns(raw_data: pd.DataFrame) -> pd.DataFrame:
     missing = [c for c in FILTER_COLUMNS if c not in raw_data.columns]
     if missing:
-        st.error(f"Missing filter columns: {', '.join(missing)}")
-        st.stop()
+        stop_with_error(f"Missing filter columns: {', '.join(missing)}")
 
     df = raw_data.copy()
     for col in FILTER_COLUMNS:
         df[col] = df[col].fillna('').astype(str).str.strip()
-
-    mask = (
-        df['Person Status Id'].isin(ALLOWED_PERSON_STATUS)
-        & df['Student Home Institution Name'].isin(allowed_institutions)
-        & df['Course Status Id'].isin(ALLOWED_COURSE_STATUS)
-        & df['Enrolment Status Id'].isin(ALLOWED_ENROLMENT_STATUS)
+    return df
+
+def compute_status_codes(df: pd.DataFrame) -> np.ndarray:
+    codes = np.zeros(len(df), dtype=np.uint8)
+    for column, allowed, flag in [
+        ('Person Status Id', ALLOWED_PERSON_STATUS, REJECT_PERSON_STATUS),
+        ('Course Status Id', ALLOWED_COURSE_STATUS, REJECT_COURSE_STATUS),
+        ('Enrolment Status Id', ALLOWED_ENROLMENT_STATUS, REJECT_ENROLMENT_STATUS)
+    ]:
+        codes |= (~df[column].isin(allowed)).to_numpy() * np.uint8(flag)
+    return codes
+
+def compute_rejection_codes(
+    df: pd.DataFrame,
+    allowed_institutions: Tuple[str, ...],
+    status_codes: Optional[np.ndarray] = None
+) -> pd.Series:
+    if status_codes is None:
+        status_codes = compute_status_codes(df)
+    institution_codes = (~df['Student Home Institution Name'].isin(allowed_institutions)).to_numpy()
+    codes = status_codes | institution_codes * np.uint8(REJECT_INSTITUTION)
+    return pd.Series(codes, index=df.index, name=REJECTION_CODE_COLUMN)
+
+def describe_rejection_codes(codes: pd.Series) -> pd.Series:
+    # At most 16 distinct codes, so labels are built per code rather than per row.
+    labels = {
+        code: "; ".join(label for flag, label in REJECTION_REASONS.items() if code & flag)
+        for code in codes.unique()
+    }
+    return codes.map(labels)
+
+def count_rejection_reasons(codes: pd.Series) -> Dict[str, int]:
+    values = codes.to_numpy()
+    counts = {label: int(np.count_nonzero(values & flag)) for flag, label in REJECTION_REASONS.items()}
+    counts['Total rejected'] = int(np.count_nonzero(values))
+    return counts
+
+def empty_rejected_rows(df: pd.DataFrame) -> pd.DataFrame:
+    return df.head(0).assign(**{REJECTION_CODE_COLUMN: pd.Series(dtype='uint8'), REJECTION_REASON_COLUMN: ''})
+
+def select_rejected_rows(df: pd.DataFrame, codes: pd.Series) -> pd.DataFrame:
+    rejected_mask = codes.ne(0)
+    rejected = df[rejected_mask].copy()
+    rejected[REJECTION_CODE_COLUMN] = codes[rejected_mask]
+    rejected[REJECTION_REASON_COLUMN] = describe_rejection_codes(rejected[REJECTION_CODE_COLUMN])
+    return rejected
+
+def split_filtered_rows(df: pd.DataFrame, allowed_institutions: Tuple[str, ...]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    # `df` must already have clean filter columns; one code pass yields both the kept and the rejected rows.
+    codes = compute_rejection_codes(df, allowed_institutions)
+    return df[codes.eq(0)].copy(), select_rejected_rows(df, codes)
+
+@cached_stage
+def split_report_rows(raw_data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    df = clean_filter_columns(raw_data)
+    status_codes = compute_status_codes(df)
+    primary_codes = compute_rejection_codes(df, ALLOWED_INSTITUTIONS_PRIMARY, status_codes)
+    secondary_codes = compute_rejection_codes(df, ALLOWED_INSTITUTIONS_SECONDARY, status_codes)
+    # A report row is only lost when it fails both institution groups. The status flags are
+    # shared, so AND-ing the two codes keeps them and keeps the institution flag only when
+    # neither group allows the row.
+    return (
+        df[primary_codes.eq(0)].copy(),
+        df[secondary_codes.eq(0)].copy(),
+        select_rejected_rows(df, primary_codes & secondary_codes)
     )
-    return df[mask].copy()
 
 def build_empty_source_frame() -> pd.DataFrame:
     base_columns = list(dict.fromkeys(REQUIRED_COLUMNS + FILTER_COLUMNS))
     return pd.DataFrame(columns=base_columns)
 
+def source_line_numbers(index: pd.Index) -> np.ndarray:
+    # Row labels from read_csv/read_excel start at 0 under a header line.
+    if pd.api.types.is_integer_dtype(index):
+        return index.to_numpy() + 2
+    return np.arange(len(index)) + 2
+
+def encode_lineage(source, file_id, rows, action=LINEAGE_ACTION_NONE) -> np.ndarray:
+    high = (((np.int64(action) << LINEAGE_SOURCE_BITS) | source) << LINEAGE_FILE_BITS) | file_id
+    return np.asarray(rows, dtype=np.int64) | (high << LINEAGE_ROW_BITS)
+
+def split_lineage(codes) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    codes = np.asarray(codes, dtype=np.int64)
+    rows = codes & ((1 << LINEAGE_ROW_BITS) - 1)
+    high = codes >> LINEAGE_ROW_BITS
+    file_ids = high & ((1 << LINEAGE_FILE_BITS) - 1)
+    high = high >> LINEAGE_FILE_BITS
+    sources = high & ((1 << LINEAGE_SOURCE_BITS) - 1)
+    return sources, file_ids, rows, high >> LINEAGE_SOURCE_BITS
+
+def restamp_lineage(codes, action: int, source: Optional[int] = None) -> np.ndarray:
+    sources, file_ids, rows, _ = split_lineage(codes)
+    return encode_lineage(sources if source is None else source, file_ids, rows, action)
+
+def attach_lineage(
+    frame: pd.DataFrame,
+    source: int,
+    file_id: int = 0,
+    rows: Optional[np.ndarray] = None
+) -> pd.DataFrame:
+    # Stages keep the source row labels, so only surviving rows are coded, after filtering.
+    if rows is None:
+        rows = source_line_numbers(frame.index)
+    return frame.assign(**{LINEAGE_COLUMN: encode_lineage(source, file_id, rows)})
+
+def describe_lineage(codes: pd.Series, file_names: Sequence[str]) -> pd.DataFrame:
+    sources, file_ids, rows, actions = split_lineage(codes)
+    # Label lookups are array takes, so decoding stays vectorised at any row count.
+    source_labels = np.array(
+        [LINEAGE_SOURCES.get(source, '') for source in range(1 << LINEAGE_SOURCE_BITS)], dtype=object
+    )
+    action_labels = np.array([LINEAGE_ACTIONS[action] for action in sorted(LINEAGE_ACTIONS)], dtype=object)
+    names = np.array(list(file_names) + [''], dtype=object)
+    file_ids = np.where(sources == LINEAGE_SOURCE_MANUAL, len(file_names), np.minimum(file_ids, len(file_names)))
+    return pd.DataFrame({
+        'Source': source_labels[sources],
+        'Source File': names[file_ids],
+        'Source Row': rows,
+        'Transfer Action': action_labels[actions]
+    }, index=codes.index, columns=LINEAGE_REPORT_COLUMNS)
+
+def summarize_lineage(codes: pd.Series, file_names: Sequence[str]) -> dict:
+    sources, file_ids, _, actions = split_lineage(codes)
+    file_counts = np.bincount(file_ids[sources != LINEAGE_SOURCE_MANUAL], minlength=len(file_names))
+    return {
+        'sources': {label: int(np.count_nonzero(sources == source)) for source, label in LINEAGE_SOURCES.items()},
+        'files': {name: int(file_counts[file_id]) for file_id, name in enumerate(file_names)},
+        'transfer_actions': {
+            label: int(np.count_nonzero(actions == action))
+            for action, label in LINEAGE_ACTIONS.items() if action != LINEAGE_ACTION_NONE
+        }
+    }
+
 def normalize_secondary_institution_name(value: str) -> str:
     cleaned = str(value).strip()
     if not cleaned:
@@ -302,38 +809,14 @@ def canonicalize_status_id(value: str, target_status: str) -> str:
         return target_status
     return cleaned
 
-@st.cache_data(show_spinner=False)
-def prepare_primary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFrame, int, int]:
+def normalize_primary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
     if import_data.empty:
-        return import_data.copy(), 0, 0
+        return import_data.copy(), 0
 
     prepared = import_data.copy()
     prepared.columns = [str(column).strip() for column in prepared.columns]
 
-    # Support both source CSV headers and patron-template XLSX headers.
-    alias_map = {
-        'First Name': ['First', 'givenName'],
-        'Middle Name': ['middleName'],
-        'Last Name': ['Last', 'Surname', 'familyName'],
-        'Nickname': ['nickname'],
-        'Student Number': ['barcode'],
-        'Email': ['emailAddress', 'username', 'idAtSource'],
-        'Address1': ['primaryStreetAddressLine1'],
-        'Address2': ['primaryStreetAddressLine2'],
-        'City': ['primaryCityOrLocality'],
-        'State': ['primaryStateOrProvince'],
-        'Postal Code': ['primaryPostalCode'],
-        'Country': ['primaryCountry'],
-        'Home Phone': ['primaryPhone'],
-        'Work Phone': ['secondaryPhone'],
-        'Mobile Phone': ['mobilePhone'],
-        'Course Level': ['customdata1'],
-        'Course Name': ['customdata2'],
-        'Course Type': ['customdata3'],
-        'Student Home Institution Name': ['patronNotes']
-    }
-
-    for target_column, alias_columns in alias_map.items():
+    for target_column, alias_columns in PRIMARY_IMPORT_ALIASES.items():
         if target_column not in prepared.columns:
             prepared[target_column] = ''
         for alias_column in alias_columns:
@@ -344,7 +827,7 @@ def prepare_primary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFrame
                 if fill_mask.any():
                     prepared.loc[fill_mask, target_column] = alias_series[fill_mask]
 
-    required_for_import = set(REQUIRED_COLUMNS + FILTER_COLUMNS)
+    required_for_import = list(dict.fromkeys(REQUIRED_COLUMNS + FILTER_COLUMNS))
     for column in required_for_import:
         if column not in prepared.columns:
             prepared[column] = ''
@@ -362,20 +845,24 @@ def prepare_primary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFrame
     )
 
     has_name = prepared['First Name'].ne('') | prepared['Last Name'].ne('')
-    prepared = prepared[has_name].copy()
-    source_name_rows = int(has_name.sum())
+    return prepared[has_name].copy(), int(has_name.sum())
+
+@cached_stage
+def prepare_primary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFrame, int, int, pd.DataFrame]:
+    prepared, source_name_rows = normalize_primary_import_rows(import_data)
     if prepared.empty:
-        return prepared, source_name_rows, 0
+        return prepared, source_name_rows, 0, empty_rejected_rows(prepared)
 
-    primary_rule_rows = apply_filters(prepared, ALLOWED_INSTITUTIONS_PRIMARY)
-    return primary_rule_rows, source_name_rows, len(primary_rule_rows)
+    # Normalizing already cleaned the filter columns.
+    primary_rule_rows, rejected = split_filtered_rows(prepared, ALLOWED_INSTITUTIONS_PRIMARY)
+    return primary_rule_rows, source_name_rows, len(primary_rule_rows), rejected
 
-@st.cache_data(show_spinner=False)
+@cached_stage
 def build_primary_transfer_candidates(primary_data: pd.DataFrame) -> pd.DataFrame:
     required_columns = ['First Name', 'Last Name', 'Student Number', 'Email']
     missing = [column for column in required_columns if column not in primary_data.columns]
     if missing:
-        st.warning(
+        show_warning(
             "Manual transfer unavailable. Missing columns: "
             f"{', '.join(sorted(missing))}"
         )
@@ -412,15 +899,73 @@ def build_primary_transfer_candidates(primary_data: pd.DataFrame) -> pd.DataFram
 
     return candidates.sort_values(by=['Last Name', 'First Name', 'Student Number', 'Email'])
 
+def tokenize_transfer_text(text: str) -> List[str]:
+    return TRANSFER_TOKEN_REGEX.findall(str(text).casefold())
+
+def build_transfer_postings(candidates: pd.DataFrame, start: int = 0) -> List[Tuple[str, int]]:
+    # Labels show the student number when there is one, so emails are indexed separately.
+    texts = candidates['__transfer_label']
+    if 'Email' in candidates.columns:
+        texts = texts + ' ' + candidates['Email']
+    return [
+        (token, position)
+        for position, text in enumerate(texts, start=start)
+        for token in set(tokenize_transfer_text(text))
+    ]
+
+@cached_stage
+def build_transfer_index(primary_data: pd.DataFrame) -> Tuple[pd.DataFrame, List[str], List[int]]:
+    # Sorted (token, position) postings: a prefix lookup is two bisects, not a scan of every label.
+    candidates = build_primary_transfer_candidates(primary_data).reset_index(drop=True)
+    postings = sorted(build_transfer_postings(candidates))
+    return candidates, [token for token, _ in postings], [position for _, position in postings]
+
+def extend_transfer_index(
+    index: Tuple[pd.DataFrame, List[str], List[int]],
+    extra_rows: pd.DataFrame
+) -> Tuple[pd.DataFrame, List[str], List[int]]:
+    candidates, tokens, positions = index
+    if extra_rows.empty or 'First Name' not in candidates.columns:
+        return index
+
+    extra = build_primary_transfer_candidates(extra_rows).reset_index(drop=True)
+    # Manual rows have no stable source index, so give them their own id space.
+    extra['__transfer_id'] = 'MN::' + extra['__transfer_id']
+    tokens, positions = list(tokens), list(positions)
+    for token, position in build_transfer_postings(extra, start=len(candidates)):
+        insert_at = bisect.bisect_right(tokens, token)
+        tokens.insert(insert_at, token)
+        positions.insert(insert_at, position)
+    return pd.concat([candidates, extra], ignore_index=True), tokens, positions
+
+def search_transfer_index(index: Tuple[pd.DataFrame, List[str], List[int]], query: str) -> np.ndarray:
+    candidates, tokens, positions = index
+    terms = set(tokenize_transfer_text(query))
+    if not terms:
+        return np.arange(len(candidates))
+
+    matches = None
+    for term in terms:
+        start = bisect.bisect_left(tokens, term)
+        end = bisect.bisect_left(tokens, term + '\U0010ffff')
+        hits = set(positions[start:end])
+        matches = hits if matches is None else matches & hits
+        if not matches:
+            break
+    # Positions follow the candidate sort order, with manual rows after report rows.
+    return np.array(sorted(matches), dtype=int)
+
 def transfer_selected_primary_record(
     selected_primary_row: pd.Series,
     secondary_data: pd.DataFrame
 ) -> Tuple[pd.DataFrame, int, str]:
     secondary = secondary_data.copy()
-    source = selected_primary_row.copy()
+    source_lineage = selected_primary_row.get(LINEAGE_COLUMN)
+    source = selected_primary_row.drop(LINEAGE_COLUMN, errors='ignore')
 
     for column in secondary.columns:
-        secondary[column] = secondary[column].fillna('').astype(str).str.strip()
+        if column != LINEAGE_COLUMN:
+            secondary[column] = secondary[column].fillna('').astype(str).str.strip()
     source = source.fillna('').astype(str).str.strip()
 
     match_mask = pd.Series(False, index=secondary.index)
@@ -435,13 +980,21 @@ def transfer_selected_primary_record(
         if column in source.index and not column.startswith('__')
     ]
 
+    has_lineage = LINEAGE_COLUMN in secondary.columns and source_lineage is not None
     if match_mask.any():
         secondary.loc[match_mask, common_columns] = source[common_columns].values
+        if has_lineage:
+            secondary.loc[match_mask, LINEAGE_COLUMN] = restamp_lineage(
+                secondary.loc[match_mask, LINEAGE_COLUMN], LINEAGE_ACTION_UPDATED
+            )
         return secondary, int(match_mask.sum()), 'updated'
 
     new_row = pd.DataFrame([
         {column: source.get(column, '') for column in secondary.columns}
     ])
+    if has_lineage:
+        # The added row keeps the file and row of the primary record it was copied from.
+        new_row[LINEAGE_COLUMN] = restamp_lineage([source_lineage], LINEAGE_ACTION_ADDED, LINEAGE_SOURCE_TRANSFER)
     secondary = pd.concat([secondary, new_row], ignore_index=True)
     return secondary, 1, 'added'
 
@@ -465,29 +1018,14 @@ def parse_manual_name(value: str) -> Tuple[str, str, str]:
 
     return name_parts[0], " ".join(name_parts[1:-1]), name_parts[-1]
 
-@st.cache_data(show_spinner=False)
-def prepare_secondary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFrame, int, int]:
+def normalize_secondary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
     if import_data.empty:
-        return import_data.copy(), 0, 0
+        return import_data.copy(), 0
 
     prepared = import_data.copy()
     prepared.columns = [str(column).strip() for column in prepared.columns]
 
-    alias_map = {
-        'First Name': ['First', 'givenName'],
-        'Middle Name': ['Middle', 'middleName'],
-        'Last Name': ['Last', 'Surname', 'familyName'],
-        'Student Number': ['Barcode', 'barcode'],
-        'Email': ['emailAddress', 'username', 'idAtSource'],
-        'Course Name': ['Course', 'customdata2'],
-        'Course Type': ['Course Type', 'customdata3'],
-        'Student Home Institution Name': ['Home College', 'College', 'patronNotes'],
-        'Person Status Id': ['Person Status Id', 'personStatus'],
-        'Course Status Id': ['Course Status Id', 'courseStatus'],
-        'Enrolment Status Id': ['Enrolment status', 'Enrollment status', 'Enrolment Status Id']
-    }
-
-    for target_column, alias_columns in alias_map.items():
+    for target_column, alias_columns in SECONDARY_IMPORT_ALIASES.items():
         if target_column not in prepared.columns:
             prepared[target_column] = ''
         for alias_column in alias_columns:
@@ -516,7 +1054,7 @@ def prepare_secondary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFra
             if fill_mask.any():
                 prepared.loc[fill_mask, target_column] = source_series[fill_mask]
 
-    required_for_import = set(REQUIRED_COLUMNS + FILTER_COLUMNS)
+    required_for_import = list(dict.fromkeys(REQUIRED_COLUMNS + FILTER_COLUMNS))
     for column in required_for_import:
         if column not in prepared.columns:
             prepared[column] = ''
@@ -552,26 +1090,35 @@ def prepare_secondary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFra
         | prepared['Student Number'].ne('')
         | prepared['Email'].ne('')
     )
-    prepared = prepared[has_identity].copy()
-    source_rows = int(has_identity.sum())
+    return prepared[has_identity].copy(), int(has_identity.sum())
+
+@cached_stage
+def prepare_secondary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFrame, int, int, pd.DataFrame]:
+    prepared, source_rows = normalize_secondary_import_rows(import_data)
     if prepared.empty:
-        return prepared, source_rows, 0
+        return prepared, source_rows, 0, empty_rejected_rows(prepared)
 
-    secondary_rule_rows = apply_filters(prepared, ALLOWED_INSTITUTIONS_SECONDARY)
-    return secondary_rule_rows, source_rows, len(secondary_rule_rows)
+    # Normalizing already cleaned the filter columns.
+    secondary_rule_rows, rejected = split_filtered_rows(prepared, ALLOWED_INSTITUTIONS_SECONDARY)
+    return secondary_rule_rows, source_rows, len(secondary_rule_rows), rejected
 
 def build_manual_name_rows(
     names_text: str,
     target: str,
     output_columns: List[str]
 ) -> Tuple[pd.DataFrame, int, int]:
-    lines = [line.strip() for line in str(names_text).splitlines() if line.strip()]
+    lines = [
+        (number, line.strip())
+        for number, line in enumerate(str(names_text).splitlines(), start=1)
+        if line.strip()
+    ]
     if not lines:
         return pd.DataFrame(columns=output_columns), 0, 0
 
     rows = []
+    line_numbers = []
     skipped = 0
-    for raw_line in lines:
+    for line_number, raw_line in lines:
         first_name, middle_name, last_name = parse_manual_name(raw_line)
         if not first_name and not last_name:
             skipped += 1
@@ -597,20 +1144,21 @@ def build_manual_name_rows(
             )
         })
         rows.append(row)
+        line_numbers.append(line_number)
 
-    return pd.DataFrame(rows, columns=output_columns), len(rows), skipped
-
-@st.cache_data(show_spinner=False)
-def transform_student_data(raw_data: pd.DataFrame, expiration_date: str) -> pd.DataFrame:
-    # -- Pre-cleaning --
-    df = raw_data.fillna('').astype(str)
-    df = df.apply(lambda col: col.str.strip())
+    # Indexed by line in the text box, which is the row number lineage records.
+    return pd.DataFrame(rows, columns=output_columns, index=line_numbers), len(rows), skipped
 
+@cached_stage
+def render_output_columns(raw_data: pd.DataFrame) -> pd.DataFrame:
     # -- Validate columns --
-    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    missing = [c for c in REQUIRED_COLUMNS if c not in raw_data.columns]
     if missing:
-        st.error(f"Missing columns: {', '.join(missing)}")
-        st.stop()
+        stop_with_error(f"Missing columns: {', '.join(missing)}")
+
+    # -- Pre-cleaning, limited to the columns the template reads --
+    df = raw_data[OUTPUT_SOURCE_COLUMNS].fillna('').astype(str)
+    df = df.apply(lambda col: col.str.strip())
 
     # -- Email sanity check --
     email_series = df['Email']
@@ -621,80 +1169,1753 @@ def transform_student_data(raw_data: pd.DataFrame, expiration_date: str) -> pd.D
     if bad_emails:
         preview = ", ".join(bad_emails[:5])
         suffix = "…" if len(bad_emails) > 5 else ""
-        st.warning(f"Invalid email formats spotted: {preview}{suffix}")
+        show_warning(f"Invalid email formats spotted: {preview}{suffix}")
 
     # -- Branch mapping check --
     abbrs = df['Student Home Institution Abbrev'].unique()
     unmapped = sorted({abbr for abbr in abbrs if abbr and abbr not in HOME_BRANCH_MAPPING})
     if unmapped:
-        st.warning(f"Unmapped branches: {', '.join(unmapped)}; using default.")
-
-    # -- Build transformed --
-    T = pd.DataFrame({
-        'prefix': "",
-        'givenName': df['First Name'],
-        'middleName': df['Middle Name'],
-        'familyName': df['Last Name'],
-        'suffix': "",
-        'nickname': df['Nickname'],
-        'canSelfEdit': False,
-        'dateOfBirth': "",
-        'gender': "",
-        'institutionId': "134059",
-        'barcode': df['Student Number'],
-        'idAtSource': df['Email'],
-        'sourceSystem': "https://idp.divinity.edu.au/realms/divinity",
-        'borrowerCategory': df['Course Type']
-            .str.upper()
-            .eq('RESEARCH')
-            .map({True: 'HDR Student', False: 'Student'}),
-        'circRegistrationDate': "",
-        'oclcExpirationDate': expiration_date,
-        'homeBranch': df['Student Home Institution Abbrev']
-                       .map(HOME_BRANCH_MAPPING)
-                       .fillna(DEFAULT_HOME_BRANCH),
-        'primaryStreetAddressLine1': df['Address1'],
-        'primaryStreetAddressLine2': df['Address2'],
-        'primaryCityOrLocality': df['City'],
-        'primaryStateOrProvince': df['State'],
-        'primaryPostalCode': df['Postal Code'],
-        'primaryCountry': df['Country'],
-        'primaryPhone': df['Home Phone'],
-        'secondaryStreetAddressLine1': "",
-        'secondaryStreetAddressLine2': "",
-        'secondaryCityOrLocality': "",
-        'secondaryStateOrProvince': "",
-        'secondaryPostalCode': "",
-        'secondaryCountry': "",
-        'secondaryPhone': df['Work Phone'],
-        'emailAddress': df['Email'],
-        'mobilePhone': df['Mobile Phone'],
-        'notificationEmail': "",
-        'notificationTextPhone': "",
-        'patronNotes': df['Student Home Institution Name'],
-        'photoURL': df['Student Home Institution Abbrev']
-                   .map(PHOTO_URL_MAPPING)
-                   .fillna(DEFAULT_PHOTO_URL),
-        'customdata1': df['Course Level'],
-        'customdata2': df['Course Name'],
-        'customdata3': df['Course Type'],
-        'customdata4': "",
-        'username': df['Email'],
-        'illId': "",
-        'illApprovalStatus': "",
-        'illPatronType': "",
-        'illPickupLocation': ""
+        show_warning(f"Unmapped branches: {', '.join(unmapped)}; using default.")
+
+    # -- Column-backed and derived slots only --
+    columns = pd.DataFrame({field: df[source] for field, source in OUTPUT_COLUMN_FIELDS.items()})
+    columns['borrowerCategory'] = (
+        df['Course Type'].str.upper().eq('RESEARCH').map({True: 'HDR Student', False: 'Student'})
+    )
+    columns['homeBranch'] = (
+        df['Student Home Institution Abbrev'].map(HOME_BRANCH_MAPPING).fillna(DEFAULT_HOME_BRANCH)
+    )
+    columns['photoURL'] = (
+        df['Student Home Institution Abbrev'].map(PHOTO_URL_MAPPING).fillna(DEFAULT_PHOTO_URL)
+    )
+    return columns
+
+def materialize_output_frame(columns: pd.DataFrame, expiration_date: str) -> pd.DataFrame:
+    constants = dict(OUTPUT_CONSTANT_FIELDS, oclcExpirationDate=expiration_date)
+    return pd.DataFrame(
+        {f: columns[f] if f in columns.columns else constants.get(f, "") for f in FIELD_ORDER},
+        index=columns.index
+    )
+
+@cached_stage
+def transform_student_data(raw_data: pd.DataFrame, expiration_date: str) -> pd.DataFrame:
+    return materialize_output_frame(render_output_columns(raw_data), expiration_date)
+
+# ---------------- Execution Backends ---------------- #
+
+# Everything str.strip() removes, so Polars cleaning matches the pandas stages exactly.
+PYTHON_WHITESPACE = (
+    '\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005'
+    '\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+)
+POLARS_ROW_INDEX = '__source_row'
+
+def import_polars():
+    try:
+        import polars as pl
+    except ImportError as e:
+        raise ImportError("The polars backend needs polars (pip install polars pyarrow).") from e
+    return pl
+
+def polars_from_pandas(frame: pd.DataFrame, strip_columns: bool = False):
+    pl = import_polars()
+    data = pl.from_pandas(frame.reset_index(drop=True))
+    data.columns = [str(column).strip() if strip_columns else str(column) for column in frame.columns]
+    return data.with_columns(pl.all().cast(pl.String)).with_row_index(POLARS_ROW_INDEX)
+
+def polars_to_pandas(data, index: pd.Index) -> pd.DataFrame:
+    rows = data[POLARS_ROW_INDEX].to_numpy()
+    result = data.drop(POLARS_ROW_INDEX).to_pandas()
+    result.index = index[rows]
+    return result
+
+def polars_clean(column: str):
+    pl = import_polars()
+    return pl.col(column).fill_null('').str.strip_chars(PYTHON_WHITESPACE)
+
+def polars_map_unique(data, column: str, func):
+    pl = import_polars()
+    values = data[column].fill_null('').unique().to_list()
+    mapping = {value: func(value) for value in values}
+    # Every value is mapped; the default keeps polars from rejecting the mapping as incomplete.
+    return pl.col(column).fill_null('').replace_strict(mapping, default='', return_dtype=pl.String)
+
+def polars_fill_blank(data, target: str, source):
+    pl = import_polars()
+    target_clean = polars_clean(target)
+    return data.with_columns(
+        pl.when(target_clean.eq('') & source.ne('')).then(source).otherwise(pl.col(target)).alias(target)
+    )
+
+def polars_coalesce_aliases(data, alias_map: Dict[str, List[str]]):
+    pl = import_polars()
+    for target_column, alias_columns in alias_map.items():
+        if target_column not in data.columns:
+            data = data.with_columns(pl.lit('').alias(target_column))
+        for alias_column in alias_columns:
+            if alias_column in data.columns:
+                data = polars_fill_blank(data, target_column, polars_clean(alias_column))
+    return data
+
+def polars_clean_required(data):
+    pl = import_polars()
+    required_for_import = list(dict.fromkeys(REQUIRED_COLUMNS + FILTER_COLUMNS))
+    missing = [column for column in required_for_import if column not in data.columns]
+    data = data.with_columns([pl.lit('').alias(column) for column in missing])
+    return data.with_columns([polars_clean(column) for column in required_for_import])
+
+def polars_fill_defaults(data, defaults: Dict[str, str]):
+    pl = import_polars()
+    return data.with_columns([
+        pl.when(pl.col(column).ne('')).then(pl.col(column)).otherwise(pl.lit(default_value)).alias(column)
+        for column, default_value in defaults.items()
+    ])
+
+def polars_fill_abbrev(data, default_abbrev: str):
+    pl = import_polars()
+    abbrev = pl.col('Student Home Institution Abbrev')
+    mapped = pl.col('Student Home Institution Name').replace_strict(
+        INSTITUTION_ABBREV_BY_NAME, default='', return_dtype=pl.String
+    )
+    data = data.with_columns(
+        pl.when(abbrev.eq('')).then(mapped).otherwise(abbrev).alias('Student Home Institution Abbrev')
+    )
+    return data.with_columns(
+        pl.when(abbrev.ne('')).then(abbrev).otherwise(pl.lit(default_abbrev)).alias('Student Home Institution Abbrev')
+    )
+
+def polars_status_code():
+    pl = import_polars()
+    code = pl.lit(0, dtype=pl.UInt8)
+    for column, allowed, flag in [
+        ('Person Status Id', ALLOWED_PERSON_STATUS, REJECT_PERSON_STATUS),
+        ('Course Status Id', ALLOWED_COURSE_STATUS, REJECT_COURSE_STATUS),
+        ('Enrolment Status Id', ALLOWED_ENROLMENT_STATUS, REJECT_ENROLMENT_STATUS)
+    ]:
+        code = code | pl.when(pl.col(column).is_in(list(allowed))).then(0).otherwise(flag).cast(pl.UInt8)
+    return code
+
+def polars_rejection_code(allowed_institutions: Tuple[str, ...], status_code=None):
+    pl = import_polars()
+    if status_code is None:
+        status_code = polars_status_code()
+    institution = pl.col('Student Home Institution Name').is_in(list(allowed_institutions))
+    return status_code | pl.when(institution).then(0).otherwise(REJECT_INSTITUTION).cast(pl.UInt8)
+
+def polars_rejected_rows(data, index: pd.Index) -> pd.DataFrame:
+    rejected = polars_to_pandas(data, index)
+    rejected[REJECTION_REASON_COLUMN] = describe_rejection_codes(rejected[REJECTION_CODE_COLUMN])
+    return rejected
+
+def polars_split_frame(data, allowed_institutions: Tuple[str, ...], index: pd.Index) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    pl = import_polars()
+    data = data.with_columns(polars_rejection_code(allowed_institutions).alias(REJECTION_CODE_COLUMN))
+    kept = data.filter(pl.col(REJECTION_CODE_COLUMN).eq(0)).drop(REJECTION_CODE_COLUMN)
+    rejected = data.filter(pl.col(REJECTION_CODE_COLUMN).ne(0))
+    return polars_to_pandas(kept, index), polars_rejected_rows(rejected, index)
+
+@cached_stage
+def polars_split_report_rows(raw_data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    missing = [c for c in FILTER_COLUMNS if c not in raw_data.columns]
+    if missing:
+        stop_with_error(f"Missing filter columns: {', '.join(missing)}")
+
+    # Only the filter columns cross into polars: the codes come back as arrays and the rows
+    # are selected in pandas, so the wide report is never converted either way.
+    data = polars_from_pandas(raw_data[FILTER_COLUMNS]).with_columns(
+        [polars_clean(column) for column in FILTER_COLUMNS]
+    )
+    status_code = polars_status_code()
+    data = data.with_columns(
+        polars_rejection_code(ALLOWED_INSTITUTIONS_PRIMARY, status_code).alias('__primary_code'),
+        polars_rejection_code(ALLOWED_INSTITUTIONS_SECONDARY, status_code).alias('__secondary_code')
+    )
+    df = raw_data.copy()
+    for column in FILTER_COLUMNS:
+        df[column] = data[column].to_pandas().set_axis(df.index)
+    primary_codes = data['__primary_code'].to_numpy()
+    secondary_codes = data['__secondary_code'].to_numpy()
+    # Same rule as split_report_rows: a row is rejected only when it fails both groups.
+    return (
+        df[primary_codes == 0].copy(),
+        df[secondary_codes == 0].copy(),
+        select_rejected_rows(
+            df, pd.Series(primary_codes & secondary_codes, index=df.index, name=REJECTION_CODE_COLUMN)
+        )
+    )
+
+@cached_stage
+def polars_prepare_primary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFrame, int, int, pd.DataFrame]:
+    if import_data.empty:
+        return import_data.copy(), 0, 0, empty_rejected_rows(import_data)
+
+    pl = import_polars()
+    data = polars_coalesce_aliases(polars_from_pandas(import_data, strip_columns=True), PRIMARY_IMPORT_ALIASES)
+    data = polars_clean_required(data)
+    data = polars_fill_defaults(data, PRIMARY_IMPORT_DEFAULTS)
+    data = polars_fill_abbrev(data, PRIMARY_IMPORT_DEFAULTS['Student Home Institution Abbrev'])
+
+    data = data.filter(pl.col('First Name').ne('') | pl.col('Last Name').ne(''))
+    source_name_rows = data.height
+    if data.is_empty():
+        prepared = polars_to_pandas(data, import_data.index)
+        return prepared, source_name_rows, 0, empty_rejected_rows(prepared)
+
+    kept, rejected = polars_split_frame(data, ALLOWED_INSTITUTIONS_PRIMARY, import_data.index)
+    return kept, source_name_rows, len(kept), rejected
+
+@cached_stage
+def polars_prepare_secondary_import_rows(import_data: pd.DataFrame) -> Tuple[pd.DataFrame, int, int, pd.DataFrame]:
+    if import_data.empty:
+        return import_data.copy(), 0, 0, empty_rejected_rows(import_data)
+
+    pl = import_polars()
+    data = polars_coalesce_aliases(polars_from_pandas(import_data, strip_columns=True), SECONDARY_IMPORT_ALIASES)
+
+    if 'Name' in data.columns:
+        # parse_manual_name runs once per distinct name, not once per row.
+        parsed = {name: parse_manual_name(name) for name in data['Name'].fill_null('').unique().to_list()}
+        for position, target_column in enumerate(['First Name', 'Middle Name', 'Last Name']):
+            source = pl.col('Name').fill_null('').replace_strict(
+                {name: parts[position] for name, parts in parsed.items()}, default='', return_dtype=pl.String
+            ).str.strip_chars(PYTHON_WHITESPACE)
+            data = polars_fill_blank(data, target_column, source)
+
+    data = polars_clean_required(data)
+    data = data.with_columns(
+        polars_map_unique(data, 'Student Home Institution Name', normalize_secondary_institution_name)
+    )
+    data = polars_fill_defaults(data, SECONDARY_IMPORT_DEFAULTS)
+    data = data.with_columns([
+        polars_map_unique(
+            data, column, lambda value, target=SECONDARY_IMPORT_DEFAULTS[column]: canonicalize_status_id(value, target)
+        )
+        for column in ['Person Status Id', 'Course Status Id', 'Enrolment Status Id']
+    ])
+    data = polars_fill_abbrev(data, DEFAULT_SECONDARY_ABBREV)
+
+    data = data.filter(
+        pl.col('First Name').ne('')
+        | pl.col('Last Name').ne('')
+        | pl.col('Student Number').ne('')
+        | pl.col('Email').ne('')
+    )
+    source_rows = data.height
+    if data.is_empty():
+        prepared = polars_to_pandas(data, import_data.index)
+        return prepared, source_rows, 0, empty_rejected_rows(prepared)
+
+    kept, rejected = polars_split_frame(data, ALLOWED_INSTITUTIONS_SECONDARY, import_data.index)
+    return kept, source_rows, len(kept), rejected
+
+@cached_stage
+def polars_render_output_columns(raw_data: pd.DataFrame) -> pd.DataFrame:
+    missing = [c for c in REQUIRED_COLUMNS if c not in raw_data.columns]
+    if missing:
+        stop_with_error(f"Missing columns: {', '.join(missing)}")
+
+    pl = import_polars()
+    data = polars_from_pandas(raw_data[OUTPUT_SOURCE_COLUMNS])
+    data = data.with_columns([polars_clean(column) for column in OUTPUT_SOURCE_COLUMNS])
+
+    # -- Same warnings as the pandas stage, checked per distinct value --
+    emails = data['Email'].unique().to_list()
+    bad_emails = sorted(email for email in emails if email and not EMAIL_REGEX.match(email))
+    if bad_emails:
+        preview = ", ".join(bad_emails[:5])
+        suffix = "…" if len(bad_emails) > 5 else ""
+        show_warning(f"Invalid email formats spotted: {preview}{suffix}")
+
+    abbrs = data['Student Home Institution Abbrev'].unique().to_list()
+    unmapped = sorted({abbr for abbr in abbrs if abbr and abbr not in HOME_BRANCH_MAPPING})
+    if unmapped:
+        show_warning(f"Unmapped branches: {', '.join(unmapped)}; using default.")
+
+    abbrev = pl.col('Student Home Institution Abbrev')
+    columns = data.select(
+        [pl.col(POLARS_ROW_INDEX)]
+        + [pl.col(source).alias(field) for field, source in OUTPUT_COLUMN_FIELDS.items()]
+        + [
+            pl.when(pl.col('Course Type').str.to_uppercase().eq('RESEARCH'))
+                .then(pl.lit('HDR Student'))
+                .otherwise(pl.lit('Student'))
+                .alias('borrowerCategory'),
+            abbrev.replace_strict(HOME_BRANCH_MAPPING, default=DEFAULT_HOME_BRANCH, return_dtype=pl.String)
+                .alias('homeBranch'),
+            abbrev.replace_strict(PHOTO_URL_MAPPING, default=DEFAULT_PHOTO_URL, return_dtype=pl.String)
+                .alias('photoURL')
+        ]
+    )
+    return polars_to_pandas(columns, raw_data.index)
+
+@cached_stage
+def polars_transform_student_data(raw_data: pd.DataFrame, expiration_date: str) -> pd.DataFrame:
+    return materialize_output_frame(polars_render_output_columns(raw_data), expiration_date)
+
+EXECUTION_BACKENDS: Dict[str, Dict[str, object]] = {
+    'pandas': {
+        'split_report_rows': split_report_rows,
+        'prepare_primary_import_rows': prepare_primary_import_rows,
+        'prepare_secondary_import_rows': prepare_secondary_import_rows,
+        'render_output_columns': render_output_columns,
+        'transform_student_data': transform_student_data
+    },
+    'polars': {
+        'split_report_rows': polars_split_report_rows,
+        'prepare_primary_import_rows': polars_prepare_primary_import_rows,
+        'prepare_secondary_import_rows': polars_prepare_secondary_import_rows,
+        'render_output_columns': polars_render_output_columns,
+        'transform_student_data': polars_transform_student_data
+    }
+}
+
+def active_backend() -> str:
+    name = os.environ.get(BACKEND_ENV, '').strip().lower() or DEFAULT_BACKEND
+    if name not in EXECUTION_BACKENDS:
+        raise ValueError(f"Unknown {BACKEND_ENV} '{name}'; expected one of {', '.join(EXECUTION_BACKENDS)}")
+    return name
+
+def use_backend(name: str) -> None:
+    os.environ[BACKEND_ENV] = name
+
+def configure_logging(level: int = logging.INFO) -> None:
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+def init_pool_worker(backend: str, log_level: int) -> None:
+    use_backend(backend)
+    # Fork-server and spawned workers start with logging unconfigured, so their
+    # warnings would print bare; give them the parent's format and level.
+    configure_logging(log_level)
+
+def run_stage(stage: str, *args):
+    return EXECUTION_BACKENDS[active_backend()][stage](*args)
+
+def start_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    # Workers forked from this process inherit the polars/pyarrow thread pools mid-lock and
+    # can hang. A fork server is a clean process with pandas already imported, so its workers
+    # start fast; spawn is the fallback where fork servers are unavailable.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['numpy', 'pandas'])
+    else:
+        context = multiprocessing.get_context('spawn')
+    # The fork server keeps the environment it started with, so a backend chosen later
+    # (e.g. by backend-parity) is handed to each worker explicitly.
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=context,
+        initializer=init_pool_worker,
+        initargs=(active_backend(), logging.getLogger().getEffectiveLevel())
+    )
+
+# ---------------- Export ---------------- #
+
+def build_role_frames(
+    raw: pd.DataFrame,
+    csv_role: str,
+    file_id: int = 0
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, int, int]:
+    if csv_role == CSV_ROLE_STANDARD:
+        filtered_primary, filtered_secondary, rejected = run_stage('split_report_rows', raw)
+        return (
+            attach_lineage(filtered_primary, LINEAGE_SOURCE_REPORT, file_id),
+            attach_lineage(filtered_secondary, LINEAGE_SOURCE_REPORT, file_id),
+            rejected,
+            0,
+            0
+        )
+
+    filtered_primary = build_empty_source_frame()
+    filtered_secondary, source_rows, applied_rows, rejected = run_stage('prepare_secondary_import_rows', raw)
+    filtered_secondary = attach_lineage(filtered_secondary, LINEAGE_SOURCE_REPORT, file_id)
+    if not filtered_secondary.empty:
+        filtered_primary = filtered_primary.reindex(columns=filtered_secondary.columns, fill_value='')
+    filtered_primary = attach_lineage(filtered_primary, LINEAGE_SOURCE_REPORT, file_id)
+    return filtered_primary, filtered_secondary, rejected, source_rows, applied_rows
+
+def finalize_output_frame(out: pd.DataFrame, overrides: Dict[str, str]) -> pd.DataFrame:
+    for column, value in overrides.items():
+        out[column] = value
+
+    # -- Force strings on key dates --
+    for d in ['dateOfBirth', 'oclcExpirationDate']:
+        if d in out:
+            out[d] = out[d].astype(str)
+    return out
+
+def build_output_frames(
+    filtered_primary: pd.DataFrame,
+    filtered_secondary: pd.DataFrame,
+    expiration_date: str
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    out_primary = finalize_output_frame(
+        run_stage('transform_student_data', filtered_primary, expiration_date),
+        OUTPUT_PROFILES['primary']
+    )
+    out_secondary = finalize_output_frame(
+        run_stage('transform_student_data', filtered_secondary, expiration_date),
+        OUTPUT_PROFILES['secondary']
+    )
+    return out_primary, out_secondary
+
+def attach_output_lineage(out: pd.DataFrame, filtered: pd.DataFrame) -> pd.DataFrame:
+    # Transformed rows keep the filtered row order, so codes line up by position.
+    return out.assign(**{LINEAGE_COLUMN: filtered[LINEAGE_COLUMN].to_numpy()})
+
+@functools.lru_cache(maxsize=65536)
+def transliterate_latin1(value: str) -> str:
+    # Compose first: decomposed input (NFD "José") would otherwise lose its accents to "?".
+    characters = []
+    for character in unicodedata.normalize('NFC', value):
+        if ord(character) < 256:
+            characters.append(character)
+        elif character in LATIN1_TRANSLITERATIONS:
+            characters.append(LATIN1_TRANSLITERATIONS[character])
+        else:
+            # Drop the accents only from characters Latin-1 cannot hold, e.g. Nguyễn -> Nguyen.
+            base = ''.join(
+                part for part in unicodedata.normalize('NFKD', character)
+                if not unicodedata.combining(part)
+            )
+            characters.append(base if base and all(ord(part) < 256 for part in base) else '?')
+    return ''.join(characters)
+
+def find_unencodable_cells(frame: pd.DataFrame, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    audits = []
+    for column in columns or frame.columns:
+        if column not in frame.columns:
+            continue
+        values = frame[column]
+        if pd.api.types.infer_dtype(values, skipna=True) != 'string':
+            continue
+        # Fast path: one C-level pass over the joined column settles most files.
+        texts = values.tolist()
+        try:
+            joined = ''.join(texts)
+        except TypeError:
+            joined = ''.join(text for text in texts if isinstance(text, str))
+        if joined.isascii():
+            continue
+        try:
+            joined.encode(OUTPUT_ENCODING)
+            continue
+        except UnicodeEncodeError:
+            pass
+
+        positions = np.flatnonzero(values.str.contains(NON_LATIN1_PATTERN, na=False).to_numpy())
+        originals = values.iloc[positions]
+        table = {value: transliterate_latin1(value) for value in originals.unique()}
+        audits.append(pd.DataFrame({
+            'Row': positions + 1,
+            'Field': column,
+            'Original': originals.to_numpy(),
+            'Transliterated': originals.map(table).to_numpy()
+        }))
+    if not audits:
+        return pd.DataFrame(columns=ENCODING_AUDIT_COLUMNS)
+    return pd.concat(audits, ignore_index=True)
+
+def transliterate_output_frame(out: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    cells = find_unencodable_cells(out)
+    if cells.empty:
+        return out, cells
+
+    out = out.copy()
+    for column, group in cells.groupby('Field', sort=False):
+        out.iloc[group['Row'].to_numpy() - 1, out.columns.get_loc(column)] = group['Transliterated'].to_numpy()
+    return out, cells
+
+def build_encoding_report(output_columns: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    reports = []
+    for profile, out in output_columns.items():
+        # Profile overrides replace their columns with constants, so only the rest reach the TXT.
+        cells = find_unencodable_cells(out, [f for f in FIELD_ORDER if f not in OUTPUT_PROFILES[profile]])
+        if cells.empty:
+            continue
+        cells.insert(0, 'Output', profile)
+        cells.insert(2, 'barcode', out['barcode'].iloc[cells['Row'].to_numpy() - 1].to_numpy())
+        reports.append(cells)
+    if not reports:
+        return pd.DataFrame(columns=['Output', 'Row', 'barcode'] + ENCODING_AUDIT_COLUMNS[1:])
+    return pd.concat(reports, ignore_index=True)
+
+def build_lineage_report(
+    filtered_frames: Dict[str, pd.DataFrame],
+    output_columns: Dict[str, pd.DataFrame],
+    file_names: Sequence[str]
+) -> pd.DataFrame:
+    reports = []
+    for profile, filtered in filtered_frames.items():
+        lineage = describe_lineage(filtered[LINEAGE_COLUMN], file_names).reset_index(drop=True)
+        lineage.insert(0, 'Output', profile)
+        lineage.insert(1, 'Row', np.arange(1, len(lineage) + 1))
+        lineage.insert(2, 'barcode', output_columns[profile]['barcode'].to_numpy())
+        reports.append(lineage)
+    return pd.concat(reports, ignore_index=True)
+
+def encode_patron_txt(out: pd.DataFrame, header: bool = True) -> bytes:
+    txt = out.to_csv(index=False, header=header, sep='\t', quoting=csv.QUOTE_NONE, escapechar='\\')
+    try:
+        return txt.encode(OUTPUT_ENCODING)
+    except UnicodeEncodeError:
+        pass
+    out, _ = transliterate_output_frame(out)
+    txt = out.to_csv(index=False, header=header, sep='\t', quoting=csv.QUOTE_NONE, escapechar='\\')
+    return txt.encode(OUTPUT_ENCODING, errors='replace')
+
+@functools.lru_cache(maxsize=32)
+def compile_output_template(
+    expiration_date: str,
+    overrides: Tuple[Tuple[str, str], ...] = ()
+) -> Tuple[Tuple[str, ...], str]:
+    # Splits a TXT row into column-backed fields and the literal text between
+    # them, so constant slots are written once per template, not once per row.
+    # The result is a str.format pattern with one {} per column-backed field.
+    constants = dict(OUTPUT_CONSTANT_FIELDS, oclcExpirationDate=expiration_date)
+    constants.update(overrides)
+    fields, pattern = [], ''
+    for position, field in enumerate(FIELD_ORDER):
+        if position:
+            pattern += '\t'
+        if field in constants or (field not in OUTPUT_COLUMN_FIELDS and field not in OUTPUT_DERIVED_FIELDS):
+            pattern += escape_output_text(str(constants.get(field, ''))).replace('{', '{{').replace('}', '}}')
+        else:
+            fields.append(field)
+            pattern += '{}'
+    return tuple(fields), pattern
+
+def escape_output_text(text: str) -> str:
+    return OUTPUT_ESCAPE_REGEX.sub(r'\\\g<0>', text)
+
+def output_column_texts(values: pd.Series) -> List[str]:
+    # One list per column; transliteration and escaping only touch columns that need them.
+    texts = values.tolist()
+    joined = ''.join(texts)
+    if not joined.isascii():
+        try:
+            joined.encode(OUTPUT_ENCODING)
+        except UnicodeEncodeError:
+            texts = [transliterate_latin1(text) for text in texts]
+            joined = ''.join(texts)
+    if any(character in joined for character in OUTPUT_ESCAPE_CHARS):
+        texts = [escape_output_text(text) for text in texts]
+    return texts
+
+def render_output_lines(
+    output_columns: pd.DataFrame,
+    expiration_date: str,
+    overrides: Dict[str, str]
+) -> List[str]:
+    fields, pattern = compile_output_template(expiration_date, tuple(sorted(overrides.items())))
+    # One format call per row builds each line once, instead of regrowing it per field.
+    return list(map(pattern.format, *(output_column_texts(output_columns[field]) for field in fields)))
+
+def render_output_txt(
+    output_columns: pd.DataFrame,
+    expiration_date: str,
+    overrides: Dict[str, str],
+    header: bool = True
+) -> bytes:
+    # Rendered a block of rows at a time, so only one block's Python strings are alive at once.
+    blocks = [('\t'.join(FIELD_ORDER) + os.linesep).encode(OUTPUT_ENCODING)] if header else []
+    for start in range(0, len(output_columns), OUTPUT_RENDER_BLOCK_ROWS):
+        lines = render_output_lines(
+            output_columns.iloc[start:start + OUTPUT_RENDER_BLOCK_ROWS], expiration_date, overrides
+        )
+        blocks.append(encode_output_lines(lines))
+    return b''.join(blocks)
+
+def encode_output_lines(lines: Sequence[str]) -> bytes:
+    return (os.linesep.join(lines) + os.linesep).encode(OUTPUT_ENCODING, errors='replace') if len(lines) else b''
+
+def render_patron_txt(
+    filtered: pd.DataFrame,
+    expiration_date: str,
+    overrides: Dict[str, str],
+    header: bool = True
+) -> bytes:
+    return render_output_txt(run_stage('render_output_columns', filtered), expiration_date, overrides, header)
+
+def transform_shard_txt(frame: pd.DataFrame, expiration_date: str, overrides: Dict[str, str]) -> List[str]:
+    return render_output_lines(run_stage('render_output_columns', frame), expiration_date, overrides)
+
+def encode_shard_txt(out: pd.DataFrame) -> List[str]:
+    # Same escaping as encode_patron_txt, one line per row so shards can be put back in row order.
+    out, _ = transliterate_output_frame(out)
+    pattern = '\t'.join(['{}'] * len(out.columns))
+    return list(map(pattern.format, *(output_column_texts(out[column].fillna('').astype(str)) for column in out.columns)))
+
+def shard_keys(abbrev: pd.Series) -> pd.Series:
+    # Keys end up in file names, so anything but a plain code (blank, "X/Y", "../") is unassigned.
+    keys = abbrev.fillna('').astype(str).str.strip()
+    return keys.where(keys.str.fullmatch(SHARD_KEY_PATTERN), SHARD_UNASSIGNED)
+
+def build_patron_txt(
+    filtered: pd.DataFrame,
+    expiration_date: str,
+    overrides: Dict[str, str],
+    shard_by_institution: bool = False,
+    workers: Optional[int] = None,
+    out: Optional[pd.DataFrame] = None
+) -> Tuple[bytes, Dict[str, bytes]]:
+    if not shard_by_institution or filtered.empty:
+        if out is None:
+            return render_patron_txt(filtered, expiration_date, overrides), {}
+        return encode_patron_txt(out), {}
+
+    header = encode_patron_txt(pd.DataFrame(columns=FIELD_ORDER))
+    keys = shard_keys(filtered['Student Home Institution Abbrev']).to_numpy()
+    max_workers = workers or os.cpu_count() or 1
+
+    # Large institutions are split further so one big shard does not bound the run.
+    chunk_rows = max(SHARD_MIN_CHUNK_ROWS, -(-len(filtered) // (max_workers * 4)))
+    # An already-transformed frame (e.g. a resumed checkpoint) shares the filtered index.
+    source = filtered if out is None else out
+    groups = pd.Series(keys).groupby(keys, sort=True).indices
+    tasks = [
+        positions[start:start + chunk_rows]
+        for positions in groups.values()
+        for start in range(0, len(positions), chunk_rows)
+    ]
+
+    frames = [source.iloc[positions] for positions in tasks]
+    if max_workers > 1 and len(tasks) > 1:
+        with start_process_pool(min(max_workers, len(tasks))) as executor:
+            if out is None:
+                bodies = list(executor.map(
+                    transform_shard_txt,
+                    frames,
+                    [expiration_date] * len(frames),
+                    [overrides] * len(frames)
+                ))
+            else:
+                bodies = list(executor.map(encode_shard_txt, frames))
+    elif out is None:
+        bodies = [transform_shard_txt(frame, expiration_date, overrides) for frame in frames]
+    else:
+        bodies = [encode_shard_txt(frame) for frame in frames]
+
+    # Lines go back to their source positions, so the combined file keeps the input row order
+    # that the encoding and lineage reports number, and each shard keeps it for its own rows.
+    lines = np.empty(len(source), dtype=object)
+    for positions, body in zip(tasks, bodies):
+        lines[positions] = body
+    shards = {key: header + encode_output_lines(lines[positions].tolist()) for key, positions in groups.items()}
+    return header + encode_output_lines(lines.tolist()), shards
+
+def estimate_row_bytes(out: pd.DataFrame) -> pd.Series:
+    # Latin-1 is one byte per character, so lengths plus escapes, tabs and the
+    # line terminator give each encoded row's size without encoding it.
+    sizes = pd.Series(len(out.columns) - 1 + len(os.linesep), index=out.index)
+    for column in out.columns:
+        values = out[column].astype(str)
+        sizes = sizes + values.str.len() + values.str.count(r'[\t"\\\r\n]')
+    return sizes
+
+def encode_bounded_parts(
+    chunk: pd.DataFrame,
+    header: bytes,
+    max_bytes: Optional[int]
+) -> List[Tuple[int, bytes]]:
+    data = header + encode_patron_txt(chunk, header=False)
+    if max_bytes and len(data) > max_bytes and len(chunk) > 1:
+        middle = len(chunk) // 2
+        return (
+            encode_bounded_parts(chunk.iloc[:middle], header, max_bytes)
+            + encode_bounded_parts(chunk.iloc[middle:], header, max_bytes)
+        )
+    return [(len(chunk), data)]
+
+def split_patron_txt(
+    out: pd.DataFrame,
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None
+) -> List[Tuple[int, bytes]]:
+    # Transliterate first so the Latin-1 size estimate matches the encoded bytes.
+    out, _ = transliterate_output_frame(out)
+    header = encode_patron_txt(out.head(0))
+    if max_bytes and max_bytes <= len(header):
+        raise ValueError(f"Part size must exceed the {len(header)}-byte header row")
+
+    total_rows = len(out)
+    bounds = []
+    if max_bytes:
+        cumulative = estimate_row_bytes(out).cumsum().to_numpy()
+        budget = max_bytes - len(header)
+        start, offset = 0, 0
+        while start < total_rows:
+            end = int(cumulative.searchsorted(offset + budget, side='right'))
+            end = max(end, start + 1)
+            if max_rows:
+                end = min(end, start + max_rows)
+            bounds.append((start, end))
+            offset = cumulative[end - 1]
+            start = end
+    elif max_rows:
+        bounds = [(start, min(start + max_rows, total_rows)) for start in range(0, total_rows, max_rows)]
+    if not bounds:
+        bounds = [(0, total_rows)]
+
+    parts = []
+    for start, end in bounds:
+        parts.extend(encode_bounded_parts(out.iloc[start:end], header, max_bytes))
+    return parts
+
+def build_patron_parts(
+    file_name: str,
+    out: pd.DataFrame,
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None
+) -> Tuple[Dict[str, bytes], dict]:
+    stem, extension = os.path.splitext(file_name)
+    files = {}
+    manifest = {
+        'file': file_name,
+        'encoding': 'ISO-8859-1',
+        'max_rows': max_rows,
+        'max_bytes': max_bytes,
+        'total_rows': len(out),
+        'parts': []
+    }
+    for number, (rows, data) in enumerate(split_patron_txt(out, max_rows, max_bytes), start=1):
+        part_name = f"{stem}.part{number:0{PART_NUMBER_DIGITS}d}{extension}"
+        files[part_name] = data
+        manifest['parts'].append({
+            'file': part_name,
+            'rows': rows,
+            'bytes': len(data),
+            'sha256': hashlib.sha256(data).hexdigest()
+        })
+    return files, manifest
+
+def parts_manifest_name(file_name: str) -> str:
+    return f"{os.path.splitext(file_name)[0]}.manifest.json"
+
+def build_parts_zip(files: Dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+def write_patron_parts(
+    output_dir: str,
+    file_name: str,
+    out: pd.DataFrame,
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None
+) -> dict:
+    files, manifest = build_patron_parts(file_name, out, max_rows, max_bytes)
+    with ThreadPoolExecutor(max_workers=min(PART_WRITE_WORKERS, len(files))) as executor:
+        list(executor.map(
+            lambda item: write_file_atomic(os.path.join(output_dir, item[0]), item[1]),
+            files.items()
+        ))
+    manifest_name = parts_manifest_name(file_name)
+    # Written after every part so the manifest only ever lists complete files.
+    write_file_atomic(
+        os.path.join(output_dir, manifest_name),
+        json.dumps(manifest, indent=2).encode('utf-8')
+    )
+    return {'manifest': manifest_name, 'parts': [part['file'] for part in manifest['parts']]}
+
+def write_patron_output(
+    output_dir: str,
+    file_name: str,
+    filtered: pd.DataFrame,
+    expiration_date: str,
+    profile: str,
+    shard_by_institution: bool = False,
+    per_shard: bool = False,
+    workers: Optional[int] = None,
+    out: Optional[pd.DataFrame] = None,
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None
+) -> dict:
+    overrides = OUTPUT_PROFILES[profile]
+    # Only the source columns the template copies into the TXT; overridden fields are constants.
+    transliterated = find_unencodable_cells(filtered, list(dict.fromkeys(
+        source for field, source in OUTPUT_COLUMN_FIELDS.items() if field not in overrides
+    )))
+    result = {
+        'file': file_name,
+        'rows': len(filtered),
+        'transliterated_rows': int(transliterated['Row'].nunique())
+    }
+    if max_rows or max_bytes:
+        if out is None:
+            out = finalize_output_frame(run_stage('transform_student_data', filtered, expiration_date), overrides)
+        result.update(write_patron_parts(output_dir, file_name, out, max_rows, max_bytes))
+        shards = {}
+        if per_shard:
+            _, shards = build_patron_txt(filtered, expiration_date, overrides, True, workers, out)
+    else:
+        txt, shards = build_patron_txt(
+            filtered,
+            expiration_date,
+            overrides,
+            shard_by_institution or per_shard,
+            workers,
+            out
+        )
+        write_file_atomic(os.path.join(output_dir, file_name), txt)
+
+    if per_shard and shards:
+        stem, extension = os.path.splitext(file_name)
+        result['shards'] = {}
+        for key, data in shards.items():
+            shard_name = f"{stem}_{key}{extension}"
+            write_file_atomic(os.path.join(output_dir, shard_name), data)
+            result['shards'][key] = shard_name
+    return result
+
+def read_process_umask() -> int:
+    # The umask can only be read by setting it, so this runs once at import, before any worker threads.
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+OUTPUT_FILE_MODE = 0o666 & ~read_process_umask()
+
+def write_file_atomic(path: str, data: bytes) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+        # mkstemp creates files as 0600; give outputs the usual umask-based mode.
+        os.chmod(tmp_path, OUTPUT_FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# ---------------- Columnar Checkpoints ---------------- #
+
+def compute_input_key(files: Sequence[Tuple[str, bytes]], options: Sequence[str] = ()) -> str:
+    digest = hashlib.sha256(f"v{CHECKPOINT_VERSION}".encode('utf-8'))
+    for name, data in sorted(files, key=lambda item: item[0]):
+        # Names matter too: role detection looks at the file name.
+        digest.update(os.path.basename(name).encode('utf-8'))
+        digest.update(hashlib.sha256(data).digest())
+    for option in options:
+        digest.update(str(option).encode('utf-8'))
+    return digest.hexdigest()
+
+def write_columnar_frame(path: str, frame: pd.DataFrame) -> None:
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer, compression=COLUMNAR_COMPRESSION)
+    write_file_atomic(path, buffer.getvalue())
+
+def read_checkpoint_manifest(output_dir: str, stem: str) -> dict:
+    manifest_path = os.path.join(output_dir, f"{stem}{CHECKPOINT_MANIFEST_SUFFIX}")
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as handle:
+        return json.load(handle)
+
+def save_checkpoint_stage(
+    output_dir: str,
+    stem: str,
+    input_key: str,
+    stage: str,
+    frames: Dict[str, pd.DataFrame],
+    details: Optional[dict] = None
+) -> Dict[str, str]:
+    manifest = read_checkpoint_manifest(output_dir, stem)
+    if manifest.get('input_key') != input_key:
+        manifest = {'input_key': input_key, 'stages': {}}
+
+    files = {}
+    for profile, frame in frames.items():
+        file_name = f"{stem}_{stage}_{profile}.parquet"
+        write_columnar_frame(os.path.join(output_dir, file_name), frame)
+        files[profile] = file_name
+
+    # Later stages are derived from earlier ones, so rewriting a stage invalidates them.
+    for later_stage in CHECKPOINT_STAGES[CHECKPOINT_STAGES.index(stage) + 1:]:
+        manifest['stages'].pop(later_stage, None)
+    manifest['stages'][stage] = dict(
+        details or {},
+        files=files,
+        completed_at=datetime.now().isoformat(timespec='seconds')
+    )
+    write_file_atomic(
+        os.path.join(output_dir, f"{stem}{CHECKPOINT_MANIFEST_SUFFIX}"),
+        json.dumps(manifest, indent=2).encode('utf-8')
+    )
+    return files
+
+def load_checkpoint(
+    output_dir: str,
+    stem: str,
+    input_key: str,
+    expiration_date: str
+) -> Tuple[str, Dict[str, Dict[str, pd.DataFrame]], dict]:
+    manifest = read_checkpoint_manifest(output_dir, stem)
+    if manifest.get('input_key') != input_key:
+        return '', {}, {}
+
+    loaded: Dict[str, Dict[str, pd.DataFrame]] = {}
+    for stage in CHECKPOINT_STAGES:
+        entry = manifest['stages'].get(stage)
+        if not entry:
+            break
+        if stage == 'transformed' and entry.get('expiration_date') != expiration_date:
+            break
+        paths = {profile: os.path.join(output_dir, name) for profile, name in entry['files'].items()}
+        if not all(os.path.exists(path) for path in paths.values()):
+            break
+        loaded[stage] = {profile: pd.read_parquet(path) for profile, path in paths.items()}
+        if stage == 'transformed':
+            # Lineage is stored for columnar readers; the TXT writers expect FIELD_ORDER only.
+            loaded[stage] = {
+                profile: frame.drop(columns=LINEAGE_COLUMN, errors='ignore')
+                for profile, frame in loaded[stage].items()
+            }
+
+    last_stage = list(loaded)[-1] if loaded else ''
+    return last_stage, loaded, manifest
+
+# ---------------- Watch Folder ---------------- #
+
+def fingerprint_file(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def detect_csv_role(
+    file_name: str,
+    columns: Sequence[str],
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS
+) -> str:
+    lowered = os.path.basename(file_name).lower()
+    if any(fnmatch.fnmatch(lowered, pattern.lower()) for pattern in secondary_patterns):
+        return CSV_ROLE_SECONDARY_ONLY
+
+    # Standard reports carry the SIS status columns; audit files do not.
+    present = {str(column).strip() for column in columns}
+    if all(column in present for column in FILTER_COLUMNS):
+        return CSV_ROLE_STANDARD
+    return CSV_ROLE_SECONDARY_ONLY
+
+def load_watch_state(output_dir: str) -> Dict[str, dict]:
+    state_path = os.path.join(output_dir, WATCH_STATE_FILE)
+    if not os.path.exists(state_path):
+        return {'seen': {}}
+    with open(state_path, 'r', encoding='utf-8') as handle:
+        state = json.load(handle)
+    state.setdefault('seen', {})
+    return state
+
+def save_watch_state(output_dir: str, state: Dict[str, dict]) -> None:
+    write_file_atomic(
+        os.path.join(output_dir, WATCH_STATE_FILE),
+        json.dumps(state, indent=2, sort_keys=True).encode('utf-8')
+    )
+
+def process_watch_file(
+    path: str,
+    fingerprint: str,
+    output_dir: str,
+    expiration_date: str,
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS,
+    export_options: Optional[dict] = None
+) -> dict:
+    started = time.perf_counter()
+    file_name = os.path.basename(path)
+    stem = f"{os.path.splitext(file_name)[0]}.{fingerprint[:12]}"
+    report = {
+        'file': file_name,
+        'fingerprint': fingerprint,
+        'processed_at': datetime.now().isoformat(timespec='seconds'),
+        'expiration_date': expiration_date
+    }
+
+    try:
+        raw = pd.read_csv(path, dtype=str)
+        csv_role = detect_csv_role(file_name, raw.columns, secondary_patterns)
+        report['role'] = csv_role
+        if csv_role == CSV_ROLE_STANDARD:
+            missing = [c for c in REQUIRED_COLUMNS if c not in raw.columns]
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+        filtered_primary, filtered_secondary, rejected, source_rows, applied_rows = build_role_frames(raw, csv_role)
+        options = dict(export_options or {})
+        columnar = options.pop('columnar', False)
+        filtered_frames = {'primary': filtered_primary, 'secondary': filtered_secondary}
+        if csv_role == CSV_ROLE_SECONDARY_ONLY:
+            del filtered_frames['primary']
+
+        out_frames = {}
+        if columnar:
+            save_checkpoint_stage(output_dir, stem, fingerprint, 'filtered', filtered_frames)
+            out_primary, out_secondary = build_output_frames(filtered_primary, filtered_secondary, expiration_date)
+            out_frames = {
+                label: out for label, out in [('primary', out_primary), ('secondary', out_secondary)]
+                if label in filtered_frames
+            }
+            save_checkpoint_stage(
+                output_dir, stem, fingerprint, 'transformed',
+                {label: attach_output_lineage(out, filtered_frames[label]) for label, out in out_frames.items()},
+                {'expiration_date': expiration_date}
+            )
+
+        outputs = {}
+        for label, filtered in filtered_frames.items():
+            outputs[label] = write_patron_output(
+                output_dir,
+                f"{stem}_{label}.txt",
+                filtered,
+                expiration_date,
+                label,
+                out=out_frames.get(label),
+                **options
+            )
+
+        if not rejected.empty:
+            rejected_name = f"{stem}_rejected.csv"
+            write_file_atomic(os.path.join(output_dir, rejected_name), rejected.to_csv(index=False).encode('utf-8'))
+            outputs['rejected'] = {'file': rejected_name, 'rows': len(rejected)}
+
+        report.update({
+            'status': 'ok',
+            'raw_rows': len(raw),
+            'rejections': count_rejection_reasons(rejected[REJECTION_CODE_COLUMN]),
+            'lineage': {
+                label: summarize_lineage(filtered[LINEAGE_COLUMN], [file_name])
+                for label, filtered in filtered_frames.items()
+            },
+            'outputs': outputs
+        })
+        if csv_role == CSV_ROLE_SECONDARY_ONLY:
+            report.update({'import_source_rows': source_rows, 'import_applied_rows': applied_rows})
+    except Exception as e:
+        report.update({'status': 'error', 'error': str(e)})
+
+    report['duration_seconds'] = round(time.perf_counter() - started, 3)
+    # The report is written last so its presence marks a complete set of outputs.
+    write_file_atomic(
+        os.path.join(output_dir, f"{stem}_report.json"),
+        json.dumps(report, indent=2).encode('utf-8')
+    )
+    return report
+
+def scan_watch_folder(
+    input_dir: str,
+    output_dir: str,
+    expiration_date: str,
+    state: Dict[str, dict],
+    stat_cache: Dict[str, Tuple[Tuple[int, int], str]],
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS,
+    settle_seconds: float = WATCH_SETTLE_SECONDS,
+    export_options: Optional[dict] = None
+) -> List[dict]:
+    reports = []
+    now = time.time()
+    entries = sorted(os.scandir(input_dir), key=lambda entry: entry.name)
+    for entry in entries:
+        if not entry.is_file() or entry.name.startswith('.') or not entry.name.lower().endswith('.csv'):
+            continue
+        stat = entry.stat()
+        # Skip files that may still be mid-copy from the SIS drop.
+        if now - stat.st_mtime < settle_seconds:
+            continue
+
+        stat_key = (stat.st_size, stat.st_mtime_ns)
+        cached = stat_cache.get(entry.path)
+        if cached and cached[0] == stat_key:
+            fingerprint = cached[1]
+        else:
+            fingerprint = fingerprint_file(entry.path)
+            stat_cache[entry.path] = (stat_key, fingerprint)
+        seen = state['seen'].get(fingerprint)
+        # Failed files are retried once touched or copied in again; unchanged, they would only fail again.
+        if seen and (seen['status'] == 'ok' or seen.get('mtime_ns') == stat.st_mtime_ns):
+            continue
+
+        report = process_watch_file(
+            entry.path, fingerprint, output_dir, expiration_date, secondary_patterns, export_options
+        )
+        state['seen'][fingerprint] = {
+            'file': entry.name,
+            'status': report['status'],
+            'processed_at': report['processed_at'],
+            'mtime_ns': stat.st_mtime_ns
+        }
+        save_watch_state(output_dir, state)
+        if report['status'] == 'ok':
+            logger.info("Processed %s (%s)", entry.name, report['role'])
+        else:
+            logger.error("Failed %s: %s", entry.name, report['error'])
+        reports.append(report)
+    return reports
+
+def watch_folder(
+    input_dir: str,
+    output_dir: str,
+    expiration_date: str,
+    poll_seconds: float = WATCH_POLL_SECONDS,
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS,
+    settle_seconds: float = WATCH_SETTLE_SECONDS,
+    once: bool = False,
+    export_options: Optional[dict] = None
+) -> None:
+    os.makedirs(output_dir, exist_ok=True)
+    state = load_watch_state(output_dir)
+    stat_cache: Dict[str, Tuple[Tuple[int, int], str]] = {}
+    logger.info("Watching %s; writing to %s", input_dir, output_dir)
+    try:
+        while True:
+            scan_watch_folder(
+                input_dir, output_dir, expiration_date, state, stat_cache,
+                secondary_patterns, settle_seconds, export_options
+            )
+            if once:
+                return
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching %s", input_dir)
+
+# ---------------- Batch ---------------- #
+
+def read_report_bytes(file_name: str, data: bytes) -> pd.DataFrame:
+    if file_name.lower().endswith('.xlsx'):
+        return pd.read_excel(io.BytesIO(data), dtype=str)
+    return pd.read_csv(io.BytesIO(data), dtype=str)
+
+def prepare_batch_file(
+    file_name: str,
+    data: bytes,
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS,
+    file_id: int = 0
+) -> dict:
+    try:
+        raw = read_report_bytes(file_name, data)
+    except Exception as e:
+        raise ValueError(f"{file_name}: {e}") from e
+    return prepare_report_frame(file_name, raw, secondary_patterns, file_id)
+
+def prepare_report_frame(
+    file_name: str,
+    raw: pd.DataFrame,
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS,
+    file_id: int = 0
+) -> dict:
+    try:
+        # XLSX files follow the app's "add names to primary" path.
+        if file_name.lower().endswith('.xlsx'):
+            role = BATCH_ROLE_PRIMARY_IMPORT
+            primary, source_rows, applied_rows, rejected = run_stage('prepare_primary_import_rows', raw)
+            primary = attach_lineage(primary, LINEAGE_SOURCE_XLSX, file_id)
+            secondary = attach_lineage(build_empty_source_frame(), LINEAGE_SOURCE_XLSX, file_id)
+        else:
+            role = detect_csv_role(file_name, raw.columns, secondary_patterns)
+            if role == CSV_ROLE_STANDARD:
+                missing = [c for c in REQUIRED_COLUMNS if c not in raw.columns]
+                if missing:
+                    raise ValueError(f"Missing columns: {', '.join(missing)}")
+            primary, secondary, rejected, source_rows, applied_rows = build_role_frames(raw, role, file_id)
+    except Exception as e:
+        raise ValueError(f"{file_name}: {e}") from e
+
+    rejected.insert(0, REJECTION_SOURCE_COLUMN, os.path.basename(file_name))
+    return {
+        'file': file_name,
+        'role': role,
+        'raw_rows': len(raw),
+        'import_source_rows': source_rows,
+        'import_applied_rows': applied_rows,
+        'primary': primary,
+        'secondary': secondary,
+        'rejected': rejected
+    }
+
+def drop_cross_file_duplicates(frames: List[pd.DataFrame]) -> Tuple[List[pd.DataFrame], List[int]]:
+    seen = {key: set() for key in TRANSFER_MATCH_KEYS}
+    kept_frames = []
+    dropped_counts = []
+    for frame in frames:
+        key_values = {}
+        duplicate = pd.Series(False, index=frame.index)
+        for key in TRANSFER_MATCH_KEYS:
+            if key not in frame.columns:
+                continue
+            values = frame[key].fillna('').astype(str).str.strip()
+            if key == 'Email':
+                values = values.str.lower()
+            key_values[key] = values
+            duplicate = duplicate | (values.ne('') & values.isin(seen[key]))
+
+        # Only keys from earlier files count, so a single file keeps its own rows.
+        for key, values in key_values.items():
+            seen[key].update(values[values.ne('') & ~duplicate].tolist())
+        kept_frames.append(frame[~duplicate])
+        dropped_counts.append(int(duplicate.sum()))
+    return kept_frames, dropped_counts
+
+def merge_batch_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    merged_columns = list(build_empty_source_frame().columns)
+    for frame in frames:
+        merged_columns += [column for column in frame.columns if column not in merged_columns]
+    aligned = [frame.reindex(columns=merged_columns, fill_value='') for frame in frames if not frame.empty]
+    if not aligned:
+        return pd.DataFrame(columns=merged_columns)
+    return pd.concat(aligned, ignore_index=True)
+
+def merge_rejected_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    leading = [REJECTION_SOURCE_COLUMN, REJECTION_CODE_COLUMN, REJECTION_REASON_COLUMN]
+    merged = merge_batch_frames(frames)
+    return merged.reindex(columns=leading + [column for column in merged.columns if column not in leading])
+
+def run_batch(
+    files: List[Tuple[str, bytes]],
+    workers: Optional[int] = None,
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, dict]:
+    started = time.perf_counter()
+    # Sort by name so the merged output does not depend on argument or upload order.
+    ordered = sorted(files, key=lambda item: item[0])
+    names = [name for name, _ in ordered]
+    payloads = [data for _, data in ordered]
+    patterns = [tuple(secondary_patterns)] * len(ordered)
+    # Lineage file ids are positions in this sorted list.
+    file_ids = list(range(len(ordered)))
+
+    max_workers = min(workers or os.cpu_count() or 1, len(ordered)) if ordered else 1
+    if max_workers > 1:
+        with start_process_pool(max_workers) as executor:
+            prepared = list(executor.map(prepare_batch_file, names, payloads, patterns, file_ids))
+    else:
+        prepared = [prepare_batch_file(*args) for args in zip(names, payloads, patterns, file_ids)]
+
+    primary_frames, primary_dropped = drop_cross_file_duplicates([item['primary'] for item in prepared])
+    secondary_frames, secondary_dropped = drop_cross_file_duplicates([item['secondary'] for item in prepared])
+    merged_primary = merge_batch_frames(primary_frames)
+    merged_secondary = merge_batch_frames(secondary_frames)
+    merged_rejected = merge_rejected_frames([item['rejected'] for item in prepared])
+    file_names = [os.path.basename(name) for name in names]
+
+    report = {
+        'processed_at': datetime.now().isoformat(timespec='seconds'),
+        'workers': max_workers,
+        'files': [
+            {
+                'file': item['file'],
+                'role': item['role'],
+                'raw_rows': item['raw_rows'],
+                'primary_rows': len(item['primary']),
+                'secondary_rows': len(item['secondary']),
+                'primary_duplicates_dropped': primary_dropped[index],
+                'secondary_duplicates_dropped': secondary_dropped[index],
+                'rejections': count_rejection_reasons(item['rejected'][REJECTION_CODE_COLUMN])
+            }
+            for index, item in enumerate(prepared)
+        ],
+        'primary_rows': len(merged_primary),
+        'secondary_rows': len(merged_secondary),
+        'rejections': count_rejection_reasons(merged_rejected[REJECTION_CODE_COLUMN]),
+        'lineage': {
+            'files': file_names,
+            'primary': summarize_lineage(merged_primary[LINEAGE_COLUMN], file_names),
+            'secondary': summarize_lineage(merged_secondary[LINEAGE_COLUMN], file_names)
+        },
+        'prepare_seconds': round(time.perf_counter() - started, 3)
+    }
+    return merged_primary, merged_secondary, merged_rejected, report
+
+def write_batch_outputs(
+    output_dir: str,
+    merged_primary: pd.DataFrame,
+    merged_secondary: pd.DataFrame,
+    report: dict,
+    expiration_date: str,
+    export_options: Optional[dict] = None,
+    out_frames: Optional[Dict[str, pd.DataFrame]] = None,
+    rejected: Optional[pd.DataFrame] = None
+) -> dict:
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {}
+    if rejected is not None:
+        write_file_atomic(
+            os.path.join(output_dir, BATCH_REJECTED_OUTPUT),
+            rejected.to_csv(index=False).encode('utf-8')
+        )
+        outputs['rejected'] = {'file': BATCH_REJECTED_OUTPUT, 'rows': len(rejected)}
+    for label, file_name, merged in [
+        ('primary', BATCH_PRIMARY_OUTPUT, merged_primary),
+        ('secondary', BATCH_SECONDARY_OUTPUT, merged_secondary)
+    ]:
+        outputs[label] = write_patron_output(
+            output_dir, file_name, merged, expiration_date, label,
+            out=(out_frames or {}).get(label),
+            **(export_options or {})
+        )
+
+    report = dict(
+        report,
+        expiration_date=expiration_date,
+        outputs=outputs,
+        export_seconds=round(time.perf_counter() - started, 3)
+    )
+    write_file_atomic(
+        os.path.join(output_dir, BATCH_REPORT_OUTPUT),
+        json.dumps(report, indent=2).encode('utf-8')
+    )
+    return report
+
+def run_batch_export(
+    output_dir: str,
+    files: List[Tuple[str, bytes]],
+    expiration_date: str,
+    workers: Optional[int] = None,
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS,
+    export_options: Optional[dict] = None,
+    resume: bool = False
+) -> dict:
+    os.makedirs(output_dir, exist_ok=True)
+    options = dict(export_options or {})
+    columnar = options.pop('columnar', False)
+    input_key = compute_input_key(files, tuple(secondary_patterns))
+
+    resumed_stage, checkpoint, manifest = '', {}, {}
+    if resume:
+        resumed_stage, checkpoint, manifest = load_checkpoint(
+            output_dir, BATCH_CHECKPOINT_STEM, input_key, expiration_date
+        )
+
+    if resumed_stage:
+        merged_primary = checkpoint['filtered']['primary']
+        merged_secondary = checkpoint['filtered']['secondary']
+        merged_rejected = checkpoint['filtered'].get('rejected')
+        report = manifest['stages']['filtered'].get('report', {})
+    else:
+        merged_primary, merged_secondary, merged_rejected, report = run_batch(
+            files, workers, secondary_patterns
+        )
+        if columnar:
+            save_checkpoint_stage(
+                output_dir, BATCH_CHECKPOINT_STEM, input_key, 'filtered',
+                {'primary': merged_primary, 'secondary': merged_secondary, 'rejected': merged_rejected},
+                {'report': report}
+            )
+
+    out_frames = checkpoint.get('transformed')
+    if out_frames is None and columnar:
+        out_primary, out_secondary = build_output_frames(merged_primary, merged_secondary, expiration_date)
+        out_frames = {'primary': out_primary, 'secondary': out_secondary}
+        save_checkpoint_stage(
+            output_dir, BATCH_CHECKPOINT_STEM, input_key, 'transformed',
+            {
+                'primary': attach_output_lineage(out_primary, merged_primary),
+                'secondary': attach_output_lineage(out_secondary, merged_secondary)
+            },
+            {'expiration_date': expiration_date}
+        )
+
+    report = dict(report, resumed_from=resumed_stage or None)
+    return write_batch_outputs(
+        output_dir, merged_primary, merged_secondary, report, expiration_date, options, out_frames,
+        merged_rejected
+    )
+
+# ---------------- Reconciliation ---------------- #
+
+def build_reconcile_keys(frame: pd.DataFrame) -> pd.DataFrame:
+    keys = pd.DataFrame(index=pd.RangeIndex(len(frame)))
+    for field in RECONCILE_FIELDS:
+        values = frame[field] if field in frame.columns else pd.Series('', index=frame.index)
+        keys[field] = values.fillna('').astype(str).str.strip().to_numpy()
+    keys['__number_key'] = keys['Student Number'].str.upper()
+    keys['__email_key'] = keys['Email'].str.lower()
+    full_name = keys['First Name'] + ' ' + keys['Last Name']
+    keys['__name_key'] = full_name.str.casefold().str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+    return keys
+
+def match_reconcile_rows(report_keys: pd.DataFrame, audit_keys: pd.DataFrame) -> pd.DataFrame:
+    pairs = []
+    report_open = report_keys.assign(__position=np.arange(len(report_keys)))
+    audit_open = audit_keys.assign(__position=np.arange(len(audit_keys)))
+    for method, key in RECONCILE_KEYS:
+        # Duplicate keys match once; the extra rows fall through to later keys or the only-in sets.
+        left = report_open.loc[report_open[key].ne(''), ['__position', key]].drop_duplicates(key)
+        right = audit_open.loc[audit_open[key].ne(''), ['__position', key]].drop_duplicates(key)
+        joined = left.merge(right, on=key, how='inner', suffixes=('_report', '_audit'))
+        pairs.append(pd.DataFrame({
+            'report_position': joined['__position_report'].to_numpy(),
+            'audit_position': joined['__position_audit'].to_numpy(),
+            'Match': method
+        }))
+        report_open = report_open[~report_open['__position'].isin(joined['__position_report'])]
+        audit_open = audit_open[~audit_open['__position'].isin(joined['__position_audit'])]
+    return pd.concat(pairs, ignore_index=True)
+
+def reconcile_secondary(report_secondary: pd.DataFrame, audit_secondary: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    report_keys = build_reconcile_keys(report_secondary)
+    audit_keys = build_reconcile_keys(audit_secondary)
+    pairs = match_reconcile_rows(report_keys, audit_keys)
+    report_positions = pairs['report_position'].to_numpy()
+    audit_positions = pairs['audit_position'].to_numpy()
+    report_lines = source_line_numbers(report_secondary.index)
+    audit_lines = source_line_numbers(audit_secondary.index)
+
+    matched = pd.DataFrame({
+        'Match': pairs['Match'].to_numpy(),
+        'Report Line': report_lines[report_positions],
+        'Audit Line': audit_lines[audit_positions]
     })
+    for field in ['First Name', 'Last Name', 'Student Number', 'Email']:
+        matched[field] = report_keys[field].to_numpy()[report_positions]
+
+    differences = []
+    difference_counts = np.zeros(len(pairs), dtype=int)
+    for field in RECONCILE_FIELDS:
+        # A field the audit never fills is a missing column, not a difference on every row.
+        if not audit_keys[field].ne('').any():
+            continue
+        report_values = report_keys[field].to_numpy()[report_positions]
+        audit_values = audit_keys[field].to_numpy()[audit_positions]
+        compare_key = RECONCILE_COMPARE_KEYS.get(field, field)
+        changed = (
+            report_keys[compare_key].to_numpy()[report_positions]
+            != audit_keys[compare_key].to_numpy()[audit_positions]
+        )
+        difference_counts += changed
+        if changed.any():
+            differences.append(pd.DataFrame({
+                'Match': pairs['Match'].to_numpy()[changed],
+                'Report Line': report_lines[report_positions][changed],
+                'Audit Line': audit_lines[audit_positions][changed],
+                'Student Number': report_keys['Student Number'].to_numpy()[report_positions][changed],
+                'Field': field,
+                'Report Value': report_values[changed],
+                'Audit Value': audit_values[changed]
+            }))
+    difference_columns = [
+        'Match', 'Report Line', 'Audit Line', 'Student Number', 'Field', 'Report Value', 'Audit Value'
+    ]
+    differences = (
+        pd.concat(differences, ignore_index=True).sort_values(['Report Line', 'Field'], kind='stable')
+        if differences else pd.DataFrame(columns=difference_columns)
+    )
+    matched['Differences'] = difference_counts
+
+    report_only = np.setdiff1d(np.arange(len(report_secondary)), report_positions)
+    audit_only = np.setdiff1d(np.arange(len(audit_secondary)), audit_positions)
+    # The line columns already say where each row came from; the packed lineage code is internal.
+    only_in_report = report_secondary.iloc[report_only].drop(columns=LINEAGE_COLUMN, errors='ignore')
+    only_in_report.insert(0, 'Report Line', report_lines[report_only])
+    only_in_audit = audit_secondary.iloc[audit_only].drop(columns=LINEAGE_COLUMN, errors='ignore')
+    only_in_audit.insert(0, 'Audit Line', audit_lines[audit_only])
+    return {
+        'matched': matched.sort_values('Report Line', kind='stable').reset_index(drop=True),
+        'only_in_audit': only_in_audit.reset_index(drop=True),
+        'only_in_report': only_in_report.reset_index(drop=True),
+        'differences': differences.reset_index(drop=True)
+    }
+
+def summarize_reconciliation(result: Dict[str, pd.DataFrame]) -> dict:
+    matched = result['matched']
+    return {
+        'matched': len(matched),
+        'matched_by': {method: int(matched['Match'].eq(method).sum()) for method, _ in RECONCILE_KEYS},
+        'matched_with_differences': int(matched['Differences'].gt(0).sum()),
+        'only_in_audit': len(result['only_in_audit']),
+        'only_in_report': len(result['only_in_report']),
+        'differences_by_field': {
+            field: int(count) for field, count in result['differences']['Field'].value_counts().items()
+        }
+    }
+
+def run_reconciliation(
+    output_dir: str,
+    report_file: Tuple[str, bytes],
+    audit_file: Tuple[str, bytes]
+) -> dict:
+    started = time.perf_counter()
+    report_raw = read_report_bytes(*report_file)
+    missing = [c for c in REQUIRED_COLUMNS if c not in report_raw.columns]
+    if missing:
+        raise ValueError(f"{report_file[0]}: Missing columns: {', '.join(missing)}")
+    _, report_secondary, _, _, _ = build_role_frames(report_raw, CSV_ROLE_STANDARD)
+    _, audit_secondary, _, _, _ = build_role_frames(read_report_bytes(*audit_file), CSV_ROLE_SECONDARY_ONLY)
+    loaded_at = time.perf_counter()
+
+    result = reconcile_secondary(report_secondary, audit_secondary)
+    reconciled_at = time.perf_counter()
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, file_name in RECONCILE_OUTPUTS.items():
+        write_file_atomic(os.path.join(output_dir, file_name), result[name].to_csv(index=False).encode('utf-8'))
+    summary = dict(
+        summarize_reconciliation(result),
+        report_file=os.path.basename(report_file[0]),
+        audit_file=os.path.basename(audit_file[0]),
+        report_secondary_rows=len(report_secondary),
+        audit_rows=len(audit_secondary),
+        load_seconds=round(loaded_at - started, 3),
+        reconcile_seconds=round(reconciled_at - loaded_at, 3),
+        outputs=RECONCILE_OUTPUTS
+    )
+    write_file_atomic(
+        os.path.join(output_dir, RECONCILE_SUMMARY_OUTPUT),
+        json.dumps(summary, indent=2).encode('utf-8')
+    )
+    return summary
+
+# ---------------- Upload ---------------- #
+
+def collect_upload_items(paths: Sequence[str]) -> List[dict]:
+    items = []
+    for path in paths:
+        if path.endswith('.manifest.json'):
+            with open(path, 'r', encoding='utf-8') as handle:
+                manifest = json.load(handle)
+            directory = os.path.dirname(path)
+            for part in manifest['parts']:
+                items.append({
+                    'path': os.path.join(directory, part['file']),
+                    'sha256': part['sha256'],
+                    'bytes': part['bytes']
+                })
+        else:
+            items.append({
+                'path': path,
+                'sha256': fingerprint_file(path),
+                'bytes': os.path.getsize(path)
+            })
+    return items
+
+def get_pooled_connection(
+    pool: threading.local,
+    created: List['http.client.HTTPConnection'],
+    lock: threading.Lock,
+    endpoint,
+    timeout: float
+) -> 'http.client.HTTPConnection':
+    import http.client
+
+    connection = getattr(pool, 'connection', None)
+    if connection is None:
+        connection_class = (
+            http.client.HTTPSConnection if endpoint.scheme == 'https' else http.client.HTTPConnection
+        )
+        connection = connection_class(endpoint.hostname, endpoint.port, timeout=timeout)
+        pool.connection = connection
+        with lock:
+            created.append(connection)
+    return connection
+
+def upload_item(
+    item: dict,
+    endpoint_url: str,
+    pool: threading.local,
+    created: List['http.client.HTTPConnection'],
+    lock: threading.Lock,
+    token: Optional[str] = None,
+    max_attempts: int = UPLOAD_MAX_ATTEMPTS,
+    backoff_seconds: float = UPLOAD_BACKOFF_SECONDS,
+    timeout: float = UPLOAD_TIMEOUT_SECONDS
+) -> dict:
+    import http.client
+
+    endpoint = urlsplit(endpoint_url)
+    target = endpoint.path or '/'
+    if endpoint.query:
+        target = f"{target}?{endpoint.query}"
+
+    with open(item['path'], 'rb') as handle:
+        data = handle.read()
+    if hashlib.sha256(data).hexdigest() != item['sha256']:
+        return dict(item, attempts=0, error="Checksum does not match the manifest")
+
+    headers = {
+        'Content-Type': 'text/plain; charset=ISO-8859-1',
+        'Content-Length': str(len(data)),
+        'X-File-Name': os.path.basename(item['path']),
+        'X-Content-SHA256': item['sha256']
+    }
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
 
-    # -- Guarantee all fields and order --
-    for f in FIELD_ORDER:
-        if f not in T.columns:
-            T[f] = ""
-    return T[FIELD_ORDER]
+    error = ''
+    for attempt in range(1, max_attempts + 1):
+        retry_after = None
+        try:
+            connection = get_pooled_connection(pool, created, lock, endpoint, timeout)
+            connection.request('POST', target, body=data, headers=headers)
+            response = connection.getresponse()
+            response_body = response.read().decode('utf-8', errors='replace')
+            if 200 <= response.status < 300:
+                return dict(item, status=response.status, attempts=attempt, response=response_body[:500])
+            error = f"HTTP {response.status}: {response_body[:200]}"
+            if response.status not in UPLOAD_RETRY_STATUSES:
+                return dict(item, status=response.status, attempts=attempt, error=error)
+            header_value = response.getheader('Retry-After', '')
+            if header_value.isdigit():
+                retry_after = float(header_value)
+        except (OSError, http.client.HTTPException) as e:
+            # Drop the broken keep-alive connection; the next attempt opens a fresh one.
+            connection = getattr(pool, 'connection', None)
+            if connection is not None:
+                connection.close()
+            pool.connection = None
+            error = str(e) or e.__class__.__name__
+
+        if attempt < max_attempts:
+            delay = backoff_seconds * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            time.sleep(retry_after if retry_after is not None else delay)
+    return dict(item, attempts=max_attempts, error=error)
+
+def load_upload_state(state_path: str) -> dict:
+    if not os.path.exists(state_path):
+        return {'accepted': {}}
+    with open(state_path, 'r', encoding='utf-8') as handle:
+        state = json.load(handle)
+    state.setdefault('accepted', {})
+    return state
+
+def upload_patron_files(
+    paths: Sequence[str],
+    endpoint_url: str,
+    state_path: str,
+    concurrency: int = UPLOAD_CONCURRENCY,
+    token: Optional[str] = None,
+    max_attempts: int = UPLOAD_MAX_ATTEMPTS,
+    backoff_seconds: float = UPLOAD_BACKOFF_SECONDS,
+    timeout: float = UPLOAD_TIMEOUT_SECONDS
+) -> dict:
+    started = time.perf_counter()
+    items = collect_upload_items(paths)
+    state = load_upload_state(state_path)
+    # Accepted parts are tracked per endpoint so a new target gets a full upload.
+    accepted = state['accepted'].setdefault(endpoint_url, {})
+    pending = [item for item in items if item['sha256'] not in accepted]
+
+    pool = threading.local()
+    created: List['http.client.HTTPConnection'] = []
+    lock = threading.Lock()
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = [
+                executor.submit(
+                    upload_item, item, endpoint_url, pool, created, lock,
+                    token, max_attempts, backoff_seconds, timeout
+                )
+                for item in pending
+            ]
+            for future in futures:
+                result = future.result()
+                results.append(result)
+                if 'error' not in result:
+                    accepted[result['sha256']] = {
+                        'file': os.path.basename(result['path']),
+                        'bytes': result['bytes'],
+                        'accepted_at': datetime.now().isoformat(timespec='seconds')
+                    }
+                    write_file_atomic(state_path, json.dumps(state, indent=2).encode('utf-8'))
+    finally:
+        for connection in created:
+            connection.close()
+
+    elapsed = time.perf_counter() - started
+    uploaded = [result for result in results if 'error' not in result]
+    uploaded_bytes = sum(result['bytes'] for result in uploaded)
+    return {
+        'endpoint': endpoint_url,
+        'files': len(items),
+        'skipped': len(items) - len(pending),
+        'uploaded': len(uploaded),
+        'failed': [
+            {'file': result['path'], 'error': result['error']}
+            for result in results if 'error' in result
+        ],
+        'retries': sum(result['attempts'] - 1 for result in results if result['attempts'] > 0),
+        'bytes': uploaded_bytes,
+        'seconds': round(elapsed, 3),
+        'megabytes_per_second': round(uploaded_bytes / 1_000_000 / elapsed, 3) if elapsed else 0.0
+    }
+
+# ---------------- Mock Ingest Server ---------------- #
+
+def build_mock_ingest_handler(
+    store_dir: Optional[str] = None,
+    fail_rate: float = 0.0,
+    latency_seconds: float = 0.0
+) -> type:
+    from http.server import BaseHTTPRequestHandler
+
+    class MockIngestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def send_json(self, status: int, payload: dict) -> None:
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if latency_seconds:
+                time.sleep(latency_seconds)
+            if random.random() < fail_rate:
+                self.send_json(503, {'error': 'injected failure'})
+                return
+
+            digest = hashlib.sha256(body).hexdigest()
+            expected = self.headers.get('X-Content-SHA256')
+            if expected and expected != digest:
+                self.send_json(400, {'error': 'checksum mismatch'})
+                return
+
+            file_name = os.path.basename(self.headers.get('X-File-Name', '')) or f"{digest[:12]}.txt"
+            if store_dir:
+                write_file_atomic(os.path.join(store_dir, file_name), body)
+            self.send_json(201, {'accepted': file_name, 'sha256': digest, 'bytes': len(body)})
+
+        def log_message(self, format: str, *args) -> None:
+            logger.debug("mock-ingest: " + format, *args)
+
+    return MockIngestHandler
+
+def run_mock_ingest_server(
+    host: str = '127.0.0.1',
+    port: int = MOCK_INGEST_PORT,
+    store_dir: Optional[str] = None,
+    fail_rate: float = 0.0,
+    latency_seconds: float = 0.0
+) -> None:
+    from http.server import ThreadingHTTPServer
+
+    if store_dir:
+        os.makedirs(store_dir, exist_ok=True)
+    server = ThreadingHTTPServer(
+        (host, port),
+        build_mock_ingest_handler(store_dir, fail_rate, latency_seconds)
+    )
+    logger.info("Mock ingest listening on http://%s:%s/ (fail rate %.0f%%)", host, port, fail_rate * 100)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Mock ingest stopped")
+    finally:
+        server.server_close()
 
 # ---------------- Main App ---------------- #
 
 def main():
+    import streamlit as st
+
     st.set_page_config(page_title="Student Enrollment Transformer", layout="wide")
     st.markdown(APP_CSS, unsafe_allow_html=True)
     st.markdown(
@@ -718,15 +2939,36 @@ def main():
             index=0
         )
         uploaded_primary_names = None
+        uploaded_audit = None
         if csv_role == CSV_ROLE_STANDARD:
             uploaded_primary_names = st.file_uploader(
                 "Optional: add names to primary (XLSX)",
                 type=["xlsx"]
             )
+            uploaded_audit = st.file_uploader(
+                "Optional: secondary audit to reconcile (CSV/XLSX)",
+                type=["csv", "xlsx"]
+            )
         exp_date = st.date_input(
             "Expiration Date",
             value=DEFAULT_EXPIRATION_DATE
         ).strftime(EXPIRATION_DATE_FORMAT)
+        max_part_rows = st.number_input(
+            "Max rows per TXT part (0 = single file)",
+            min_value=0,
+            value=0,
+            step=1000
+        )
+        max_part_mb = st.number_input(
+            "Max MB per TXT part (0 = no limit)",
+            min_value=0.0,
+            value=0.0,
+            step=1.0
+        )
+        split_by_institution = st.checkbox(
+            "Per-institution TXT downloads",
+            help="Also offer one TXT per home institution so branches can be loaded independently."
+        )
         st.caption("Output format: tab-delimited TXT encoded as ISO-8859-1.")
         if csv_role == CSV_ROLE_STANDARD:
             st.caption(
@@ -739,6 +2981,18 @@ def main():
                 "Secondary import mode: supports audit headers such as "
                 "Barcode/Name/Course/Home College/Email/Enrolment status."
             )
+        with st.expander("Pipeline cache"):
+            stage_cache = get_stage_cache()
+            cache_stats = stage_cache.stats()
+            st.caption(
+                f"{cache_stats['entries']:,} entries using "
+                f"{cache_stats['bytes'] / 1024 / 1024:,.1f} of "
+                f"{cache_stats['max_bytes'] / 1024 / 1024:,.0f} MB. "
+                f"{cache_stats['hits']:,} hits, {cache_stats['misses']:,} misses, "
+                f"{cache_stats['evictions']:,} evictions."
+            )
+            if st.button("Clear pipeline cache"):
+                stage_cache.clear()
 
     if not uploaded:
         st.info("Waiting on that CSV...")
@@ -786,14 +3040,21 @@ def main():
 
     if csv_role == CSV_ROLE_STANDARD:
         with st.spinner("Applying filters…"):
-            filtered_primary = apply_filters(raw, ALLOWED_INSTITUTIONS_PRIMARY)
-            filtered_secondary = apply_filters(raw, ALLOWED_INSTITUTIONS_SECONDARY)
+            filtered_primary, filtered_secondary, rejected_rows, _, _ = build_role_frames(raw, csv_role)
+        rejected_sources = [rejected_rows.assign(**{REJECTION_SOURCE_COLUMN: uploaded.name})]
 
         filtered_primary_base_count = len(filtered_primary)
         if not primary_import_raw.empty:
-            imported_primary_rows, primary_import_source_rows, primary_import_applied_rows = (
-                prepare_primary_import_rows(primary_import_raw)
+            (
+                imported_primary_rows,
+                primary_import_source_rows,
+                primary_import_applied_rows,
+                imported_rejected_rows
+            ) = run_stage('prepare_primary_import_rows', primary_import_raw)
+            rejected_sources.append(
+                imported_rejected_rows.assign(**{REJECTION_SOURCE_COLUMN: uploaded_primary_names.name})
             )
+            imported_primary_rows = attach_lineage(imported_primary_rows, LINEAGE_SOURCE_XLSX, file_id=1)
             if primary_import_applied_rows > 0:
                 merged_columns = list(filtered_primary.columns) + [
                     column for column in imported_primary_rows.columns
@@ -807,12 +3068,14 @@ def main():
                 )
     else:
         with st.spinner("Preparing secondary import…"):
-            filtered_primary = build_empty_source_frame()
-            filtered_secondary, secondary_import_source_rows, secondary_import_applied_rows = (
-                prepare_secondary_import_rows(raw)
-            )
-            if not filtered_secondary.empty:
-                filtered_primary = filtered_primary.reindex(columns=filtered_secondary.columns, fill_value='')
+            (
+                filtered_primary,
+                filtered_secondary,
+                rejected_rows,
+                secondary_import_source_rows,
+                secondary_import_applied_rows
+            ) = build_role_frames(raw, csv_role)
+        rejected_sources = [rejected_rows.assign(**{REJECTION_SOURCE_COLUMN: uploaded.name})]
 
     st.success(
         "Filters applied: "
@@ -848,6 +3111,57 @@ def main():
                     f"Skipped {skipped_rows:,} secondary CSV row(s) that did not pass secondary rules."
                 )
 
+    rejected_rows = merge_rejected_frames(rejected_sources)
+    rejection_counts = count_rejection_reasons(rejected_rows[REJECTION_CODE_COLUMN])
+    with st.expander(f"Rejected rows ({rejection_counts['Total rejected']:,})"):
+        reason_cols = st.columns(len(REJECTION_REASONS), gap="large")
+        for reason_col, label in zip(reason_cols, REJECTION_REASONS.values()):
+            reason_col.metric(label, f"{rejection_counts[label]:,}")
+        st.caption(
+            "A row can fail several rules. Rejection Code adds up the failed rules: "
+            + ", ".join(f"{flag} = {label.lower()}" for flag, label in REJECTION_REASONS.items())
+            + "."
+        )
+        st.download_button(
+            "Download rejected rows CSV",
+            data=rejected_rows.to_csv(index=False),
+            file_name="rejected_rows.csv",
+            mime="text/csv"
+        )
+
+    if uploaded_audit is not None:
+        st.markdown("<div class='section-title'>Reconciliation</div>", unsafe_allow_html=True)
+        try:
+            audit_raw = read_report_bytes(uploaded_audit.name, uploaded_audit.getvalue())
+        except Exception as e:
+            st.error(f"Couldn’t read audit file: {e}")
+        else:
+            _, audit_secondary, _, _, _ = build_role_frames(audit_raw, CSV_ROLE_SECONDARY_ONLY)
+            # Compared before manual edits so both sides reflect their source files.
+            reconciliation = reconcile_secondary(filtered_secondary, audit_secondary)
+            summary = summarize_reconciliation(reconciliation)
+            recon_cols = st.columns(4, gap="large")
+            recon_cols[0].metric("Matched", f"{summary['matched']:,}")
+            recon_cols[1].metric("With differences", f"{summary['matched_with_differences']:,}")
+            recon_cols[2].metric("Only in audit", f"{summary['only_in_audit']:,}")
+            recon_cols[3].metric("Only in report", f"{summary['only_in_report']:,}")
+            st.caption(
+                "Matched on "
+                + ", ".join(f"{method}: {count:,}" for method, count in summary['matched_by'].items())
+                + "."
+            )
+            recon_tabs = st.tabs(["Differences", "Only in audit", "Only in report", "Matched"])
+            for tab, name in zip(recon_tabs, ['differences', 'only_in_audit', 'only_in_report', 'matched']):
+                with tab:
+                    st.dataframe(reconciliation[name])
+                    st.download_button(
+                        f"Download {RECONCILE_OUTPUTS[name]}",
+                        data=reconciliation[name].to_csv(index=False),
+                        file_name=RECONCILE_OUTPUTS[name],
+                        mime="text/csv",
+                        key=f"reconcile-{name}"
+                    )
+
     st.markdown("<div class='section-title'>Manual names</div>", unsafe_allow_html=True)
     st.caption(
         "Type one name per line. Supported formats: `First Last`, `First Middle Last`, or `Last, First`."
@@ -864,11 +3178,16 @@ def main():
             placeholder="Alex Lee\nMorgan, Casey"
         )
 
+    # The transfer index is keyed on rows before manual names, so typing names only extends it.
+    transfer_base_primary = filtered_primary
     manual_primary_rows, manual_primary_added, manual_primary_skipped = build_manual_name_rows(
         manual_primary_names,
         'primary',
         filtered_primary.columns.tolist()
     )
+    manual_primary_rows = attach_lineage(
+        manual_primary_rows, LINEAGE_SOURCE_MANUAL, rows=manual_primary_rows.index.to_numpy()
+    )
     if manual_primary_added > 0:
         filtered_primary = pd.concat([filtered_primary, manual_primary_rows], ignore_index=True)
 
@@ -877,6 +3196,9 @@ def main():
         'secondary',
         filtered_secondary.columns.tolist()
     )
+    manual_secondary_rows = attach_lineage(
+        manual_secondary_rows, LINEAGE_SOURCE_MANUAL, rows=manual_secondary_rows.index.to_numpy()
+    )
     if manual_secondary_added > 0:
         filtered_secondary = pd.concat([filtered_secondary, manual_secondary_rows], ignore_index=True)
 
@@ -892,13 +3214,51 @@ def main():
         st.warning(f"Skipped {skipped_manual_names:,} manual name line(s) that could not be parsed.")
 
     st.markdown("<div class='section-title'>Manual transfer</div>", unsafe_allow_html=True)
-    transfer_candidates = build_primary_transfer_candidates(filtered_primary)
-    transfer_labels = dict(
-        zip(transfer_candidates['__transfer_id'], transfer_candidates['__transfer_label'])
+    transfer_index = extend_transfer_index(
+        build_transfer_index(transfer_base_primary),
+        manual_primary_rows if manual_primary_added > 0 else manual_primary_rows.iloc[0:0]
+    )
+    search_cols = st.columns([3, 1], gap="large")
+    with search_cols[0]:
+        transfer_query = st.text_input(
+            "Search primary data",
+            placeholder="Name, student number or email (prefixes work)"
+        )
+    transfer_matches = search_transfer_index(transfer_index, transfer_query)
+    transfer_page_count = max(1, -(-len(transfer_matches) // TRANSFER_PAGE_SIZE))
+    with search_cols[1]:
+        # Keyed on the query so a new search starts again at page 1.
+        transfer_page = st.number_input(
+            "Page",
+            min_value=1,
+            max_value=transfer_page_count,
+            value=1,
+            step=1,
+            key=f"transfer-page-{transfer_query}-{transfer_page_count}"
+        )
+    page_start = (int(transfer_page) - 1) * TRANSFER_PAGE_SIZE
+    transfer_candidates = transfer_index[0].iloc[
+        transfer_matches[page_start:page_start + TRANSFER_PAGE_SIZE]
+    ]
+    st.caption(
+        f"{len(transfer_matches):,} match(es); showing "
+        f"{min(page_start + 1, len(transfer_matches)):,}–{page_start + len(transfer_candidates):,}."
     )
+    # The pick lives in session state, outside the page's options, so a new search or page
+    # does not silently drop a transfer chosen earlier; it stays first in the list instead.
+    transfer_ids = transfer_index[0]['__transfer_id']
+    remembered_transfer_id = st.session_state.get(TRANSFER_SELECTION_STATE, "")
+    if remembered_transfer_id and not transfer_ids.eq(remembered_transfer_id).any():
+        remembered_transfer_id = ""
+    transfer_options = [""] + transfer_candidates['__transfer_id'].tolist()
+    if remembered_transfer_id and remembered_transfer_id not in transfer_options:
+        transfer_options.insert(1, remembered_transfer_id)
+    listed = transfer_index[0][transfer_ids.isin(transfer_options)]
+    transfer_labels = dict(zip(listed['__transfer_id'], listed['__transfer_label']))
     selected_transfer_id = st.selectbox(
         "Choose one name from primary data to copy into secondary data",
-        options=[""] + transfer_candidates['__transfer_id'].tolist(),
+        options=transfer_options,
+        index=transfer_options.index(remembered_transfer_id),
         format_func=lambda transfer_id: (
             "No manual transfer"
             if transfer_id == ""
@@ -909,14 +3269,13 @@ def main():
             "Secondary output rules (institutionId, borrowerCategory, homeBranch) still apply."
         )
     )
+    st.session_state[TRANSFER_SELECTION_STATE] = selected_transfer_id
 
     transferred_name_rows = 0
     selected_transfer_label = ""
     transfer_action = "none"
     if selected_transfer_id:
-        selected_primary_row = transfer_candidates[
-            transfer_candidates['__transfer_id'].eq(selected_transfer_id)
-        ].iloc[0]
+        selected_primary_row = transfer_index[0][transfer_ids.eq(selected_transfer_id)].iloc[0]
         filtered_secondary, transferred_name_rows, transfer_action = transfer_selected_primary_record(
             selected_primary_row,
             filtered_secondary
@@ -934,24 +3293,32 @@ def main():
     with dl_cols[0]:
         st.download_button(
             "Download primary filtered CSV",
-            data=filtered_primary.to_csv(index=False),
+            data=filtered_primary.drop(columns=LINEAGE_COLUMN).to_csv(index=False),
             file_name="filtered_report_primary.csv",
             mime="text/csv"
         )
     with dl_cols[1]:
         st.download_button(
             "Download secondary filtered CSV",
-            data=filtered_secondary.to_csv(index=False),
+            data=filtered_secondary.drop(columns=LINEAGE_COLUMN).to_csv(index=False),
             file_name="filtered_report_secondary.csv",
             mime="text/csv"
         )
 
     with st.spinner("Transforming…"):
-        out_primary = transform_student_data(filtered_primary, exp_date)
-        out_secondary = transform_student_data(filtered_secondary, exp_date)
-        out_secondary['institutionId'] = '51546'
-        out_secondary['borrowerCategory'] = 'Home Colleges'
-        out_secondary['homeBranch'] = '266145'
+        # One render per profile feeds the reports, previews and TXT downloads; the full
+        # 46-column frame is only built for the preview rows.
+        output_columns = {
+            'primary': run_stage('render_output_columns', filtered_primary),
+            'secondary': run_stage('render_output_columns', filtered_secondary)
+        }
+        preview_primary, preview_secondary = (
+            finalize_output_frame(
+                materialize_output_frame(output_columns[profile].head(OUTPUT_PREVIEW_ROWS), exp_date),
+                OUTPUT_PROFILES[profile]
+            )
+            for profile in ['primary', 'secondary']
+        )
     st.success("Transformation complete.")
     st.markdown(
         f"<div class='file-chip'>Loaded: {uploaded.name}</div>",
@@ -976,32 +3343,113 @@ def main():
 
     st.markdown("<div class='section-title'>Export</div>", unsafe_allow_html=True)
 
-    # -- Force strings on key dates --
-    for d in ['dateOfBirth', 'oclcExpirationDate']:
-        if d in out_primary:
-            out_primary[d] = out_primary[d].astype(str)
-        if d in out_secondary:
-            out_secondary[d] = out_secondary[d].astype(str)
+    encoding_report = build_encoding_report(output_columns)
+    if not encoding_report.empty:
+        affected_rows = encoding_report[['Output', 'Row']].drop_duplicates()
+        st.warning(
+            f"{len(affected_rows):,} row(s) contain characters ISO-8859-1 cannot encode; "
+            "they were transliterated in the TXT files."
+        )
+        with st.expander(f"Transliterated values ({len(encoding_report):,})"):
+            st.dataframe(encoding_report)
+            st.download_button(
+                "Download transliteration report CSV",
+                data=encoding_report.to_csv(index=False),
+                file_name="transliterated_values.csv",
+                mime="text/csv"
+            )
+
+    # File ids match the attach_lineage calls above: the report is 0, the XLSX is 1.
+    lineage_files = [uploaded.name]
+    if uploaded_primary_names is not None:
+        lineage_files.append(uploaded_primary_names.name)
+    lineage_report = build_lineage_report(
+        {'primary': filtered_primary, 'secondary': filtered_secondary},
+        output_columns,
+        lineage_files
+    )
+    with st.expander("Row lineage"):
+        lineage_tabs = st.tabs(["Primary", "Secondary"])
+        for tab, profile in zip(lineage_tabs, ['primary', 'secondary']):
+            with tab:
+                counts = lineage_report.loc[lineage_report['Output'].eq(profile), 'Source'].value_counts()
+                lineage_cols = st.columns(len(LINEAGE_SOURCES), gap="large")
+                for lineage_col, label in zip(lineage_cols, LINEAGE_SOURCES.values()):
+                    lineage_col.metric(label, f"{int(counts.get(label, 0)):,}")
+        st.caption(
+            "Source Row is the line in the uploaded file (header = line 1) "
+            "or, for manual names, the line in the text box."
+        )
+        st.download_button(
+            "Download row lineage CSV",
+            data=lineage_report.to_csv(index=False),
+            file_name="row_lineage.csv",
+            mime="text/csv"
+        )
 
     # -- Download button --
-    txt_primary = out_primary.to_csv(index=False, sep='\t', quoting=csv.QUOTE_NONE, escapechar='\\')
-    txt_secondary = out_secondary.to_csv(index=False, sep='\t', quoting=csv.QUOTE_NONE, escapechar='\\')
     txt_cols = st.columns(2, gap="large")
     with txt_cols[0]:
         st.download_button(
             "Download primary TXT",
-            data=txt_primary.encode('latin-1', errors='replace'),
+            data=render_output_txt(output_columns['primary'], exp_date, OUTPUT_PROFILES['primary']),
             file_name="transformed_data_primary.txt",
             mime="text/plain; charset=ISO-8859-1"
         )
     with txt_cols[1]:
         st.download_button(
             "Download secondary TXT",
-            data=txt_secondary.encode('latin-1', errors='replace'),
+            data=render_output_txt(output_columns['secondary'], exp_date, OUTPUT_PROFILES['secondary']),
             file_name="transformed_data_secondary.txt",
             mime="text/plain; charset=ISO-8859-1"
         )
 
+    if max_part_rows or max_part_mb:
+        part_files = {}
+        part_summaries = []
+        try:
+            for profile in ['primary', 'secondary']:
+                file_name = f"transformed_data_{profile}.txt"
+                files, manifest = build_patron_parts(
+                    file_name,
+                    finalize_output_frame(
+                        materialize_output_frame(output_columns[profile], exp_date),
+                        OUTPUT_PROFILES[profile]
+                    ),
+                    max_rows=int(max_part_rows) or None,
+                    max_bytes=int(max_part_mb * 1024 * 1024) or None
+                )
+                part_files.update(files)
+                part_files[parts_manifest_name(file_name)] = json.dumps(manifest, indent=2).encode('utf-8')
+                part_summaries.append(f"{file_name}: {len(manifest['parts'])} part(s)")
+        except ValueError as e:
+            st.error(f"Couldn’t split TXT: {e}")
+        else:
+            st.download_button(
+                "Download TXT parts (ZIP)",
+                data=build_parts_zip(part_files),
+                file_name="transformed_data_parts.zip",
+                mime="application/zip"
+            )
+            st.caption("; ".join(part_summaries))
+
+    if split_by_institution:
+        with st.expander("Per-institution TXT downloads"):
+            for profile, filtered in [('primary', filtered_primary), ('secondary', filtered_secondary)]:
+                # Sharded in-process: worker processes are reserved for the CLI modes.
+                _, shards = build_patron_txt(
+                    filtered, exp_date, OUTPUT_PROFILES[profile],
+                    shard_by_institution=True, workers=1
+                )
+                for key, data in shards.items():
+                    st.download_button(
+                        f"Download {profile} TXT ({key})",
+                        data=data,
+                        file_name=f"transformed_data_{profile}_{key}.txt",
+                        mime="text/plain; charset=ISO-8859-1",
+                        key=f"shard-{profile}-{key}"
+                    )
+
     st.markdown("<div class='section-title'>Preview</div>", unsafe_allow_html=True)
     preview_tab, full_tab, filtered_tab, txt_tab = st.tabs(
         ["Preview", "Full transformed", "Filtered data", "TXT preview"]
@@ -1013,9 +3461,11 @@ def main():
             st.dataframe(filtered_primary.head())
         with right:
             st.subheader("Transformed")
-            st.dataframe(out_primary.head())
+            st.dataframe(preview_primary.head())
     with full_tab:
-        st.dataframe(out_primary)
+        st.dataframe(preview_primary)
+        if len(output_columns['primary']) > OUTPUT_PREVIEW_ROWS:
+            st.caption(f"First {OUTPUT_PREVIEW_ROWS:,} of {len(output_columns['primary']):,} rows.")
     with filtered_tab:
         full_left, full_right = st.columns(2, gap="large")
         with full_left:
@@ -1028,10 +3478,511 @@ def main():
         txt_left, txt_right = st.columns(2, gap="large")
         with txt_left:
             st.subheader("Primary TXT")
-            st.dataframe(out_primary)
+            st.dataframe(preview_primary)
         with txt_right:
             st.subheader("Secondary TXT")
-            st.dataframe(out_secondary)
+            st.dataframe(preview_secondary)
+        if max(len(columns) for columns in output_columns.values()) > OUTPUT_PREVIEW_ROWS:
+            st.caption(f"Showing the first {OUTPUT_PREVIEW_ROWS:,} rows of each file.")
+
+# ---------------- Command Line ---------------- #
+
+CLI_COMMANDS: Tuple[str, ...] = (
+    'watch', 'batch', 'reconcile', 'upload', 'mock-ingest', 'bench-import', 'backend-parity', 'regression',
+    '-h', '--help'
+)
+
+def run_import_benchmark(runs: int = IMPORT_BENCH_RUNS, budget_seconds: float = IMPORT_BUDGET_SECONDS) -> dict:
+    import statistics
+    import subprocess
+
+    script = os.path.abspath(__file__)
+    probe = (
+        "import sys, time; started = time.perf_counter(); "
+        "import patron_loading_transform; "
+        "print(time.perf_counter() - started, 'streamlit' in sys.modules)"
+    )
+    import_seconds, cli_seconds = [], []
+    streamlit_loaded = False
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-c', probe],
+            cwd=os.path.dirname(script), capture_output=True, text=True, check=True
+        )
+        elapsed, loaded = result.stdout.split()
+        import_seconds.append(float(elapsed))
+        streamlit_loaded = streamlit_loaded or loaded == 'True'
+
+        # Whole-process cold start, as a scheduled CLI run would see it.
+        started = time.perf_counter()
+        subprocess.run([sys.executable, script, '--help'], capture_output=True, check=True)
+        cli_seconds.append(time.perf_counter() - started)
+
+    cli_median = statistics.median(cli_seconds)
+    return {
+        'runs': runs,
+        'budget_seconds': budget_seconds,
+        'import_median_seconds': round(statistics.median(import_seconds), 3),
+        'cli_median_seconds': round(cli_median, 3),
+        'streamlit_imported': streamlit_loaded,
+        'passed': cli_median <= budget_seconds and not streamlit_loaded
+    }
+
+def first_difference(expected: bytes, actual: bytes) -> Optional[dict]:
+    expected_lines = expected.split(b'\n')
+    actual_lines = actual.split(b'\n')
+    for line_number, (left, right) in enumerate(zip(expected_lines, actual_lines), start=1):
+        if left != right:
+            left_fields, right_fields = left.split(b'\t'), right.split(b'\t')
+            field_number = next(
+                (i for i, (a, b) in enumerate(zip(left_fields, right_fields)) if a != b),
+                min(len(left_fields), len(right_fields))
+            )
+            field = FIELD_ORDER[field_number] if field_number < len(FIELD_ORDER) else None
+            return {'line': line_number, 'field': field}
+    if len(expected_lines) != len(actual_lines):
+        return {'line': min(len(expected_lines), len(actual_lines)) + 1, 'field': None}
+    return None
+
+def time_pipeline(
+    file_name: str,
+    raw: pd.DataFrame,
+    expiration_date: str,
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS,
+    repeat: int = 1
+) -> Tuple[Dict[str, bytes], Dict[str, float]]:
+    best: Dict[str, float] = {}
+    # Best of `repeat` runs; the stage cache is off outside Streamlit, so every run is cold.
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        prepared = prepare_report_frame(file_name, raw, secondary_patterns)
+        prepared_at = time.perf_counter()
+        # Timed through the template renderer, the writer batch, watch and the app ship.
+        encoded = {
+            profile: render_patron_txt(prepared[profile], expiration_date, OUTPUT_PROFILES[profile])
+            for profile in ['primary', 'secondary']
+        }
+        finished = time.perf_counter()
+        run = {
+            'prepare_seconds': prepared_at - started,
+            'render_seconds': finished - prepared_at,
+            'total_seconds': finished - started
+        }
+        best = {key: min(value, best.get(key, value)) for key, value in run.items()}
+    return encoded, {key: round(value, 4) for key, value in best.items()}
+
+def encode_output_frames(prepared: dict, expiration_date: str) -> Dict[str, bytes]:
+    # The frame writer still serves resumed checkpoints and part files, so parity holds it to the renderer.
+    out_primary, out_secondary = build_output_frames(prepared['primary'], prepared['secondary'], expiration_date)
+    return {'primary': encode_patron_txt(out_primary), 'secondary': encode_patron_txt(out_secondary)}
+
+def render_sharded_outputs(prepared: dict, expiration_date: str, workers: int) -> Dict[str, bytes]:
+    outputs = {}
+    for profile in ['primary', 'secondary']:
+        combined, shards = build_patron_txt(
+            prepared[profile],
+            expiration_date,
+            OUTPUT_PROFILES[profile],
+            shard_by_institution=True,
+            workers=workers
+        )
+        outputs[f"{profile}:sharded"] = combined
+        for key, payload in shards.items():
+            outputs[f"{profile}:shard-{key}"] = payload
+    return outputs
+
+def run_backend_parity(
+    files: Sequence[Tuple[str, bytes]],
+    expiration_date: str,
+    backends: Sequence[str] = tuple(EXECUTION_BACKENDS),
+    repeat: int = 1,
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS,
+    workers: int = PARITY_SHARD_WORKERS
+) -> dict:
+    previous_backend = os.environ.get(BACKEND_ENV)
+    results = []
+    try:
+        for file_name, data in files:
+            started = time.perf_counter()
+            raw = read_report_bytes(file_name, data)
+            entry = {'file': file_name, 'rows': len(raw), 'parse_seconds': round(time.perf_counter() - started, 4)}
+            outputs, timings, mismatches = {}, {}, {}
+            for backend in backends:
+                use_backend(backend)
+                outputs[backend], timings[backend] = time_pipeline(
+                    file_name, raw, expiration_date, secondary_patterns, repeat
+                )
+                prepared = prepare_report_frame(file_name, raw, secondary_patterns)
+                for profile, payload in encode_output_frames(prepared, expiration_date).items():
+                    difference = first_difference(outputs[backend][profile], payload)
+                    if difference:
+                        mismatches[f"{backend}:{profile}:frame-writer"] = difference
+
+                # Worker processes render the shards, so this also covers the pool start method.
+                sharded = render_sharded_outputs(prepared, expiration_date, workers)
+                for profile in ['primary', 'secondary']:
+                    difference = first_difference(outputs[backend][profile], sharded[f"{profile}:sharded"])
+                    if difference:
+                        mismatches[f"{backend}:{profile}:sharded"] = difference
+                outputs[backend].update(sharded)
+
+            reference = backends[0]
+            for backend in backends[1:]:
+                for output in dict.fromkeys(list(outputs[reference]) + list(outputs[backend])):
+                    difference = first_difference(outputs[reference].get(output, b''), outputs[backend].get(output, b''))
+                    if difference:
+                        mismatches[f"{backend}:{output}"] = difference
+            entry.update({
+                'timings': timings,
+                'sha256': {
+                    output: hashlib.sha256(payload).hexdigest()
+                    for output, payload in outputs[reference].items()
+                },
+                'identical': not mismatches,
+                'mismatches': mismatches
+            })
+            results.append(entry)
+    finally:
+        if previous_backend is None:
+            os.environ.pop(BACKEND_ENV, None)
+        else:
+            os.environ[BACKEND_ENV] = previous_backend
+
+    return {
+        'backends': list(backends),
+        'repeat': repeat,
+        'shard_workers': workers,
+        'files': results,
+        'passed': all(entry['identical'] for entry in results)
+    }
+
+def list_regression_fixtures(fixtures_dir: str) -> List[str]:
+    return sorted(
+        name for name in os.listdir(fixtures_dir)
+        if name.lower().endswith(('.csv', '.xlsx')) and os.path.isfile(os.path.join(fixtures_dir, name))
+    )
+
+def run_regression(
+    fixtures_dir: str,
+    update: bool = False,
+    tolerance: float = REGRESSION_TOLERANCE,
+    repeat: int = 3,
+    secondary_patterns: Sequence[str] = WATCH_SECONDARY_PATTERNS
+) -> dict:
+    golden_dir = os.path.join(fixtures_dir, REGRESSION_GOLDEN_DIR)
+    baseline_path = os.path.join(golden_dir, REGRESSION_BASELINE_FILE)
+    baselines = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, 'r', encoding='utf-8') as handle:
+            baselines = json.load(handle)
+    # Goldens are pinned to one expiration date so they do not drift with the default.
+    expiration = baselines.get('expiration_date') or DEFAULT_EXPIRATION_DATE.strftime(EXPIRATION_DATE_FORMAT)
+    stage_baselines = baselines.get('files', {})
+
+    results = []
+    for fixture in list_regression_fixtures(fixtures_dir):
+        with open(os.path.join(fixtures_dir, fixture), 'rb') as handle:
+            data = handle.read()
+        raw = read_report_bytes(fixture, data)
+        encoded, timings = time_pipeline(fixture, raw, expiration, secondary_patterns, repeat)
+        stem = os.path.splitext(fixture)[0]
+        entry = {'file': fixture, 'timings': timings, 'outputs': {}, 'slow_stages': {}}
+
+        for profile, payload in encoded.items():
+            golden_name = f"{stem}_{profile}.txt"
+            golden_path = os.path.join(golden_dir, golden_name)
+            if update:
+                os.makedirs(golden_dir, exist_ok=True)
+                write_file_atomic(golden_path, payload)
+                entry['outputs'][profile] = 'updated'
+                continue
+            if not os.path.exists(golden_path):
+                entry['outputs'][profile] = 'missing golden'
+                continue
+            with open(golden_path, 'rb') as handle:
+                difference = first_difference(handle.read(), payload)
+            entry['outputs'][profile] = difference or 'identical'
+
+        if not update:
+            for stage, seconds in timings.items():
+                baseline = stage_baselines.get(fixture, {}).get(stage)
+                # Sub-slack differences on small fixtures are timer noise, not regressions.
+                if baseline is not None and seconds > max(
+                    baseline * (1 + tolerance), baseline + REGRESSION_MIN_SLACK_SECONDS
+                ):
+                    entry['slow_stages'][stage] = {'baseline': baseline, 'seconds': seconds}
+        entry['passed'] = (
+            all(status in ('identical', 'updated') for status in entry['outputs'].values())
+            and not entry['slow_stages']
+        )
+        results.append(entry)
+
+    if update:
+        write_file_atomic(baseline_path, json.dumps({
+            'expiration_date': expiration,
+            'recorded_at': datetime.now().isoformat(timespec='seconds'),
+            'backend': active_backend(),
+            'files': {entry['file']: entry['timings'] for entry in results}
+        }, indent=2).encode('utf-8'))
+
+    return {
+        'fixtures_dir': fixtures_dir,
+        'expiration_date': expiration,
+        'tolerance': tolerance,
+        'updated': update,
+        'files': results,
+        'passed': bool(results) and all(entry['passed'] for entry in results)
+    }
+
+def add_backend_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--backend', choices=tuple(EXECUTION_BACKENDS), default=None,
+                        help=f"Execution backend for filter and transform stages (default: ${BACKEND_ENV} or {DEFAULT_BACKEND}).")
+
+def add_export_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--shard-by-institution', action='store_true',
+                        help="Transform and encode each institution in its own worker process.")
+    parser.add_argument('--per-shard-files', action='store_true',
+                        help="Also write one TXT per institution (implies --shard-by-institution).")
+    parser.add_argument('--max-rows', type=int, default=None,
+                        help="Split each TXT into numbered parts of at most this many rows.")
+    parser.add_argument('--max-bytes', type=int, default=None,
+                        help="Split each TXT into numbered parts of at most this many bytes.")
+    parser.add_argument('--columnar', action='store_true',
+                        help="Also write filtered and transformed frames as Parquet checkpoints (needs pyarrow).")
+
+def export_options_from_args(args: argparse.Namespace) -> dict:
+    return {
+        'shard_by_institution': args.shard_by_institution,
+        'per_shard': args.per_shard_files,
+        'workers': args.workers,
+        'max_rows': args.max_rows,
+        'max_bytes': args.max_bytes,
+        'columnar': args.columnar
+    }
+
+def build_cli_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='patron_loading_transform.py',
+        description="Headless modes for the student enrollment transformer."
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    watch = subparsers.add_parser('watch', help="Process report CSVs dropped into a folder.")
+    watch.add_argument('input_dir', help="Folder the SIS drops report CSVs into.")
+    watch.add_argument('output_dir', help="Folder for TXT outputs and run reports.")
+    watch.add_argument('--expiration', type=date.fromisoformat, default=DEFAULT_EXPIRATION_DATE,
+                       help="Expiration date (YYYY-MM-DD).")
+    watch.add_argument('--interval', type=float, default=WATCH_POLL_SECONDS,
+                       help="Seconds between folder scans.")
+    watch.add_argument('--settle', type=float, default=WATCH_SETTLE_SECONDS,
+                       help="Ignore files modified within this many seconds.")
+    watch.add_argument('--secondary-pattern', action='append', dest='secondary_patterns',
+                       help="Filename glob treated as a secondary-only audit (repeatable).")
+    watch.add_argument('--once', action='store_true', help="Scan once and exit.")
+    watch.add_argument('--workers', type=int, default=None,
+                       help="Worker processes for sharded exports (defaults to the CPU count).")
+    add_export_arguments(watch)
+    add_backend_argument(watch)
+
+    batch = subparsers.add_parser('batch', help="Merge many CSV/XLSX reports into one pair of outputs.")
+    batch.add_argument('output_dir', help="Folder for the merged TXT outputs and batch report.")
+    batch.add_argument('files', nargs='+', help="Report CSVs and patron-name XLSX files.")
+    batch.add_argument('--expiration', type=date.fromisoformat, default=DEFAULT_EXPIRATION_DATE,
+                       help="Expiration date (YYYY-MM-DD).")
+    batch.add_argument('--workers', type=int, default=None,
+                       help="Worker processes (defaults to the CPU count).")
+    batch.add_argument('--secondary-pattern', action='append', dest='secondary_patterns',
+                       help="Filename glob treated as a secondary-only audit (repeatable).")
+    batch.add_argument('--resume', action='store_true',
+                       help="Start from the last completed checkpoint when the inputs are unchanged.")
+    add_export_arguments(batch)
+    add_backend_argument(batch)
+
+    reconcile = subparsers.add_parser(
+        'reconcile', help="Match a secondary audit against a standard report's secondary split."
+    )
+    reconcile.add_argument('report', help="Standard report CSV.")
+    reconcile.add_argument('audit', help="Pilgrim/Trinity audit CSV or XLSX.")
+    reconcile.add_argument('output_dir', help="Folder for the reconciliation CSVs and summary.")
+    add_backend_argument(reconcile)
+
+    upload = subparsers.add_parser('upload', help="Upload TXT files or part manifests to an ingest endpoint.")
+    upload.add_argument('endpoint', help="Ingest URL that accepts one file per POST.")
+    upload.add_argument('files', nargs='+', help="TXT files or .manifest.json files listing parts.")
+    upload.add_argument('--concurrency', type=int, default=UPLOAD_CONCURRENCY,
+                        help="Simultaneous uploads (one pooled connection each).")
+    upload.add_argument('--attempts', type=int, default=UPLOAD_MAX_ATTEMPTS,
+                        help="Attempts per file before giving up.")
+    upload.add_argument('--backoff', type=float, default=UPLOAD_BACKOFF_SECONDS,
+                        help="Base delay in seconds for exponential backoff.")
+    upload.add_argument('--timeout', type=float, default=UPLOAD_TIMEOUT_SECONDS,
+                        help="Socket timeout in seconds.")
+    upload.add_argument('--state', default=None,
+                        help=f"Resume file of accepted parts (defaults to {UPLOAD_STATE_FILE} beside the first file).")
+    upload.add_argument('--token-env', default=UPLOAD_TOKEN_ENV,
+                        help="Environment variable holding a bearer token, if any.")
+
+    bench = subparsers.add_parser('bench-import', help="Check CLI cold start against a time budget.")
+    bench.add_argument('--runs', type=int, default=IMPORT_BENCH_RUNS)
+    bench.add_argument('--budget', type=float, default=IMPORT_BUDGET_SECONDS,
+                       help="Maximum median seconds for `patron_loading_transform.py --help`.")
+
+    parity = subparsers.add_parser('backend-parity', help="Check every backend writes identical TXT and time each stage.")
+    parity.add_argument('files', nargs='*',
+                        help="Report CSVs and patron-name XLSX files (default: the committed regression fixtures).")
+    parity.add_argument('--expiration', type=date.fromisoformat, default=DEFAULT_EXPIRATION_DATE,
+                        help="Expiration date (YYYY-MM-DD).")
+    parity.add_argument('--repeat', type=int, default=3, help="Runs per backend; the fastest is reported.")
+    parity.add_argument('--workers', type=int, default=PARITY_SHARD_WORKERS,
+                        help="Worker processes for the sharded check; 2 or more exercises the process pool.")
+    parity.add_argument('--secondary-pattern', action='append', dest='secondary_patterns',
+                        help="Filename glob treated as a secondary-only audit (repeatable).")
+
+    regression = subparsers.add_parser(
+        'regression', help="Compare fixture outputs with golden TXT files and stage timings with baselines."
+    )
+    regression.add_argument('fixtures_dir', nargs='?', default=REGRESSION_FIXTURES_DIR,
+                            help=f"Folder of report CSV/XLSX fixtures; goldens live in {REGRESSION_GOLDEN_DIR}/ "
+                                 "(default: the fixtures/ folder next to this script).")
+    regression.add_argument('--update', action='store_true',
+                            help="Rewrite the golden TXT files and timing baselines from this run.")
+    regression.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                            help="Allowed fractional slowdown per stage before the run fails.")
+    regression.add_argument('--repeat', type=int, default=3, help="Runs per fixture; the fastest is compared.")
+    regression.add_argument('--secondary-pattern', action='append', dest='secondary_patterns',
+                            help="Filename glob treated as a secondary-only audit (repeatable).")
+    add_backend_argument(regression)
+
+    mock = subparsers.add_parser('mock-ingest', help="Run a local ingest server for offline upload testing.")
+    mock.add_argument('--host', default='127.0.0.1')
+    mock.add_argument('--port', type=int, default=MOCK_INGEST_PORT)
+    mock.add_argument('--store', default=None, help="Folder to save received files into.")
+    mock.add_argument('--fail-rate', type=float, default=0.0,
+                      help="Fraction of requests answered with 503 to exercise retries.")
+    mock.add_argument('--latency', type=float, default=0.0, help="Seconds to delay each response.")
+    return parser
+
+def run_cli(argv: List[str]) -> int:
+    args = build_cli_parser().parse_args(argv)
+    configure_logging()
+
+    if args.command == 'upload':
+        state_path = args.state or os.path.join(os.path.dirname(args.files[0]), UPLOAD_STATE_FILE)
+        report = upload_patron_files(
+            args.files,
+            args.endpoint,
+            state_path,
+            concurrency=args.concurrency,
+            token=os.environ.get(args.token_env) or None,
+            max_attempts=args.attempts,
+            backoff_seconds=args.backoff,
+            timeout=args.timeout
+        )
+        print(json.dumps(report, indent=2))
+        return 1 if report['failed'] else 0
+    if args.command == 'bench-import':
+        report = run_import_benchmark(args.runs, args.budget)
+        print(json.dumps(report, indent=2))
+        return 0 if report['passed'] else 1
+    if args.command == 'mock-ingest':
+        run_mock_ingest_server(args.host, args.port, args.store, args.fail_rate, args.latency)
+        return 0
+    if args.command == 'reconcile':
+        if args.backend:
+            os.environ[BACKEND_ENV] = args.backend
+        files = []
+        for path in [args.report, args.audit]:
+            with open(path, 'rb') as handle:
+                files.append((path, handle.read()))
+        try:
+            summary = run_reconciliation(args.output_dir, files[0], files[1])
+        except ValueError as e:
+            logger.error("Reconciliation failed: %s", e)
+            return 1
+        print(json.dumps(summary, indent=2))
+        return 0
+    if args.command == 'regression':
+        if args.backend:
+            os.environ[BACKEND_ENV] = args.backend
+        try:
+            report = run_regression(
+                args.fixtures_dir,
+                update=args.update,
+                tolerance=args.tolerance,
+                repeat=args.repeat,
+                secondary_patterns=tuple(args.secondary_patterns or WATCH_SECONDARY_PATTERNS)
+            )
+        except (ImportError, OSError, ValueError) as e:
+            logger.error("Regression run failed: %s", e)
+            return 1
+        print(json.dumps(report, indent=2))
+        return 0 if report['passed'] else 1
+
+    expiration_date = args.expiration.strftime(EXPIRATION_DATE_FORMAT)
+    if args.command == 'backend-parity':
+        paths = args.files or [
+            os.path.join(REGRESSION_FIXTURES_DIR, name) for name in list_regression_fixtures(REGRESSION_FIXTURES_DIR)
+        ]
+        files = []
+        for path in paths:
+            with open(path, 'rb') as handle:
+                files.append((path, handle.read()))
+        try:
+            report = run_backend_parity(
+                files,
+                expiration_date,
+                repeat=args.repeat,
+                secondary_patterns=tuple(args.secondary_patterns or WATCH_SECONDARY_PATTERNS),
+                workers=args.workers
+            )
+        except (ImportError, ValueError) as e:
+            logger.error("Parity run failed: %s", e)
+            return 1
+        print(json.dumps(report, indent=2))
+        return 0 if report['passed'] else 1
+
+    # Set before any worker pool starts so child processes inherit it.
+    if args.backend:
+        os.environ[BACKEND_ENV] = args.backend
+    if args.command == 'watch':
+        watch_folder(
+            args.input_dir,
+            args.output_dir,
+            expiration_date,
+            poll_seconds=args.interval,
+            secondary_patterns=tuple(args.secondary_patterns or WATCH_SECONDARY_PATTERNS),
+            settle_seconds=args.settle,
+            once=args.once,
+            export_options=export_options_from_args(args)
+        )
+    elif args.command == 'batch':
+        files = []
+        for path in args.files:
+            with open(path, 'rb') as handle:
+                files.append((path, handle.read()))
+        try:
+            report = run_batch_export(
+                args.output_dir,
+                files,
+                expiration_date,
+                workers=args.workers,
+                secondary_patterns=tuple(args.secondary_patterns or WATCH_SECONDARY_PATTERNS),
+                export_options=export_options_from_args(args),
+                resume=args.resume
+            )
+        except ValueError as e:
+            logger.error("Batch failed: %s", e)
+            return 1
+        except ImportError as e:
+            logger.error("Columnar output unavailable: %s", e)
+            return 1
+        logger.info(
+            "Wrote %s primary and %s secondary rows from %s file(s)",
+            report['primary_rows'], report['secondary_rows'], len(files)
+        )
+    return 0
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(run_cli(sys.argv[1:]))
     main()
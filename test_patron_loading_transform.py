@@ -0,0 +1,406 @@
+import os
+import subprocess
+import sys
+import threading
+import types
+import unicodedata
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import patron_loading_transform as ptl
+
+EXPIRATION = '2026-12-31T00:00:00'
+
+def fixture_bytes(name: str) -> bytes:
+    with open(os.path.join(ptl.REGRESSION_FIXTURES_DIR, name), 'rb') as handle:
+        return handle.read()
+
+@pytest.fixture
+def prepared() -> dict:
+    return ptl.prepare_batch_file('report_standard.csv', fixture_bytes('report_standard.csv'))
+
+# ---------------- Sharding ---------------- #
+
+def test_shard_keys_only_allow_plain_codes():
+    abbrev = pd.Series(['PIL', ' CTC ', 'X/Y', '../evil', '', None, 'a b', 'ok-1_2'])
+    assert ptl.shard_keys(abbrev).tolist() == [
+        'PIL', 'CTC', 'UNASSIGNED', 'UNASSIGNED', 'UNASSIGNED', 'UNASSIGNED', 'UNASSIGNED', 'ok-1_2'
+    ]
+
+def test_per_shard_files_stay_in_output_dir(tmp_path, prepared):
+    filtered = prepared['primary'].copy()
+    filtered.iloc[:2, filtered.columns.get_loc('Student Home Institution Abbrev')] = ['X/Y', '../evil']
+    result = ptl.write_patron_output(
+        str(tmp_path), 'out.txt', filtered, EXPIRATION, 'primary', per_shard=True, workers=1
+    )
+    assert 'UNASSIGNED' in result['shards']
+    assert sorted(os.listdir(tmp_path)) == sorted(['out.txt'] + list(result['shards'].values()))
+
+@pytest.mark.parametrize('profile', ['primary', 'secondary'])
+def test_sharded_output_keeps_source_row_order(prepared, profile):
+    filtered = prepared[profile]
+    overrides = ptl.OUTPUT_PROFILES[profile]
+    plain = ptl.render_patron_txt(filtered, EXPIRATION, overrides)
+    out = ptl.finalize_output_frame(ptl.transform_student_data(filtered, EXPIRATION), overrides)
+
+    combined, shards = ptl.build_patron_txt(filtered, EXPIRATION, overrides, True, 1)
+    frame_combined, frame_shards = ptl.build_patron_txt(filtered, EXPIRATION, overrides, True, 1, out)
+    assert combined == plain
+    assert frame_combined == plain
+    assert shards == frame_shards
+
+    keys = ptl.shard_keys(filtered['Student Home Institution Abbrev'])
+    for key, payload in shards.items():
+        assert payload == ptl.render_patron_txt(filtered[keys.eq(key).to_numpy()], EXPIRATION, overrides)
+
+# ---------------- Encoding ---------------- #
+
+def test_transliterate_composes_decomposed_input(prepared):
+    decomposed = unicodedata.normalize('NFD', 'José Nguyễn')
+    assert ptl.transliterate_latin1(decomposed) == 'José Nguyen'
+
+    filtered = prepared['primary'].iloc[:1].assign(**{'First Name': decomposed})
+    txt = ptl.render_patron_txt(filtered, EXPIRATION, {}).decode(ptl.OUTPUT_ENCODING)
+    assert '\tJosé Nguyen\t' in txt
+
+def test_output_audit_only_scans_template_columns(tmp_path, prepared):
+    filtered = prepared['primary'].copy()
+    filtered['Person Status Id'] = 'PERSON_ACTIVE✓'
+    filtered['First Name'] = ['Zoë'] + ['Plain'] * (len(filtered) - 1)
+    result = ptl.write_patron_output(str(tmp_path), 'out.txt', filtered, EXPIRATION, 'primary')
+    assert result['transliterated_rows'] == 1
+
+# ---------------- Reconciliation ---------------- #
+
+def test_reconcile_ignores_case_in_match_keys():
+    report = pd.DataFrame({
+        'First Name': ['Ana', 'Ben'], 'Last Name': ['Lopez', 'Ng'],
+        'Student Number': ['s0000001', 'S0000002'], 'Email': ['Ana@Example.edu.au', 'ben@example.edu.au']
+    })
+    audit = pd.DataFrame({
+        'First Name': ['Ana', 'Ben'], 'Last Name': ['Lopez', 'Ng'],
+        'Student Number': ['S0000001', ''], 'Email': [' ana@example.edu.au', 'BEN@EXAMPLE.EDU.AU']
+    })
+    result = ptl.reconcile_secondary(report, audit)
+    assert result['matched']['Match'].tolist() == ['Student Number', 'Email']
+    assert result['differences']['Field'].tolist() == ['Student Number']
+    assert result['differences']['Audit Value'].tolist() == ['']
+    assert result['only_in_audit'].empty and result['only_in_report'].empty
+
+# ---------------- Backends ---------------- #
+
+def test_backends_write_identical_txt():
+    pytest.importorskip('polars')
+    files = [
+        (name, fixture_bytes(name)) for name in ptl.list_regression_fixtures(ptl.REGRESSION_FIXTURES_DIR)
+    ]
+    report = ptl.run_backend_parity(files, EXPIRATION)
+    assert report['passed'], [result['mismatches'] for result in report['results']]
+
+def test_polars_split_matches_pandas():
+    pytest.importorskip('polars')
+    raw = ptl.read_report_bytes('report_standard.csv', fixture_bytes('report_standard.csv'))
+    for expected, actual in zip(ptl.split_report_rows(raw), ptl.polars_split_report_rows(raw)):
+        pd.testing.assert_frame_equal(expected, actual)
+
+# ---------------- Watch folder ---------------- #
+
+def test_watch_retries_failed_files_once_touched(tmp_path):
+    input_dir, output_dir = tmp_path / 'in', tmp_path / 'out'
+    input_dir.mkdir()
+    output_dir.mkdir()
+    bad = input_dir / 'report.csv'
+    bad.write_text('')
+    state, stat_cache = ptl.load_watch_state(str(output_dir)), {}
+
+    def scan():
+        return ptl.scan_watch_folder(str(input_dir), str(output_dir), EXPIRATION, state, stat_cache, settle_seconds=0)
+
+    assert [report['status'] for report in scan()] == ['error']
+    assert scan() == []
+
+    stat = os.stat(bad)
+    os.utime(bad, ns=(stat.st_atime_ns, stat.st_mtime_ns - 1_000_000_000))
+    assert [report['status'] for report in scan()] == ['error']
+
+    bad.write_bytes(fixture_bytes('report_standard.csv'))
+    assert [report['status'] for report in scan()] == ['ok']
+    assert scan() == []
+
+# ---------------- Batch ---------------- #
+
+def test_cross_file_duplicates_drop_later_rows_only():
+    first = pd.DataFrame({'Student Number': ['S1', 'S1', ''], 'Email': ['a@x.au', 'b@x.au', '']})
+    second = pd.DataFrame({'Student Number': ['S2', '', 'S3', ''], 'Email': [' A@X.AU', 'b@x.au', 'c@x.au', '']})
+    kept, dropped = ptl.drop_cross_file_duplicates([first, second])
+    assert len(kept[0]) == 3
+    assert kept[1].index.tolist() == [2, 3]
+    assert dropped == [0, 2]
+
+def test_batch_drops_rows_already_in_an_earlier_file(prepared):
+    data = fixture_bytes('report_standard.csv')
+    merged_primary, _, _, report = ptl.run_batch([('b.csv', data), ('a.csv', data)], workers=1)
+    keys = prepared['primary'][ptl.TRANSFER_MATCH_KEYS].fillna('').apply(lambda column: column.str.strip())
+    keyless = int(keys.eq('').all(axis=1).sum())
+    # Rows with neither key cannot be matched, so the second copy keeps only those.
+    assert [item['file'] for item in report['files']] == ['a.csv', 'b.csv']
+    assert report['files'][1]['primary_duplicates_dropped'] == len(prepared['primary']) - keyless
+    assert len(merged_primary) == len(prepared['primary']) + keyless
+
+# ---------------- Checkpoints ---------------- #
+
+def test_columnar_checkpoint_resumes_with_identical_txt(tmp_path):
+    pytest.importorskip('pyarrow')
+    files = [('report_standard.csv', fixture_bytes('report_standard.csv'))]
+    first = ptl.run_batch_export(str(tmp_path), files, EXPIRATION, workers=1, export_options={'columnar': True})
+    txt = (tmp_path / ptl.BATCH_PRIMARY_OUTPUT).read_bytes()
+    assert first['resumed_from'] is None
+
+    manifest = ptl.read_checkpoint_manifest(str(tmp_path), ptl.BATCH_CHECKPOINT_STEM)
+    assert list(manifest['stages']) == list(ptl.CHECKPOINT_STAGES)
+    transformed = pd.read_parquet(tmp_path / manifest['stages']['transformed']['files']['primary'])
+    assert list(transformed.columns) == ptl.FIELD_ORDER + [ptl.LINEAGE_COLUMN]
+
+    resumed = ptl.run_batch_export(
+        str(tmp_path), files, EXPIRATION, workers=1, export_options={'columnar': True}, resume=True
+    )
+    assert resumed['resumed_from'] == 'transformed'
+    assert (tmp_path / ptl.BATCH_PRIMARY_OUTPUT).read_bytes() == txt
+
+    # Another expiration date keeps the filtered stage but not the transformed one.
+    other = ptl.run_batch_export(str(tmp_path), files, '2027-12-31T00:00:00', workers=1, resume=True)
+    assert other['resumed_from'] == 'filtered'
+
+# ---------------- Parts ---------------- #
+
+@pytest.mark.parametrize('max_rows, max_bytes', [(7, None), (None, 2500), (5, 2500)])
+def test_parts_respect_bounds_and_rejoin_to_the_whole_file(prepared, max_rows, max_bytes):
+    out = ptl.finalize_output_frame(ptl.transform_student_data(prepared['primary'], EXPIRATION), {})
+    whole = ptl.encode_patron_txt(ptl.transliterate_output_frame(out)[0])
+    header = ptl.encode_patron_txt(out.head(0))
+
+    files, manifest = ptl.build_patron_parts('out.txt', out, max_rows, max_bytes)
+    assert list(files) == [part['file'] for part in manifest['parts']]
+    assert sum(part['rows'] for part in manifest['parts']) == len(out)
+    for part in manifest['parts']:
+        data = files[part['file']]
+        assert data.startswith(header)
+        assert not max_rows or part['rows'] <= max_rows
+        assert not max_bytes or len(data) <= max_bytes
+    assert header + b''.join(data[len(header):] for data in files.values()) == whole
+
+def test_parts_reject_a_size_below_the_header(prepared):
+    out = ptl.finalize_output_frame(ptl.transform_student_data(prepared['primary'], EXPIRATION), {})
+    with pytest.raises(ValueError, match='header row'):
+        ptl.split_patron_txt(out, max_bytes=100)
+
+# ---------------- Upload ---------------- #
+
+@pytest.fixture
+def ingest_server(tmp_path):
+    def start(fail_rate: float):
+        server = ThreadingHTTPServer(
+            ('127.0.0.1', 0), ptl.build_mock_ingest_handler(str(tmp_path / 'received'), fail_rate)
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/ingest"
+
+    servers = []
+    (tmp_path / 'received').mkdir()
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def test_upload_retries_then_resumes(tmp_path, prepared, ingest_server, monkeypatch):
+    out = ptl.finalize_output_frame(ptl.transform_student_data(prepared['primary'], EXPIRATION), {})
+    written = ptl.write_patron_parts(str(tmp_path), 'out.txt', out, max_rows=10)
+    manifest = str(tmp_path / written['manifest'])
+    state_path = str(tmp_path / 'upload_state.json')
+
+    failing = ingest_server(1.0)
+    report = ptl.upload_patron_files([manifest], failing, state_path, max_attempts=2, backoff_seconds=0)
+    assert report['uploaded'] == 0 and len(report['failed']) == len(written['parts'])
+    assert report['retries'] == len(written['parts'])
+
+    # Every part is refused once, then accepted on its retry.
+    answers = iter([0.0, 1.0] * len(written['parts']))
+    monkeypatch.setattr(ptl.random, 'random', lambda: next(answers))
+    flaky = ingest_server(0.5)
+    report = ptl.upload_patron_files([manifest], flaky, state_path, concurrency=1, backoff_seconds=0)
+    assert report['uploaded'] == len(written['parts']) and not report['failed']
+    assert report['retries'] == len(written['parts'])
+    for part in written['parts']:
+        assert (tmp_path / 'received' / part).read_bytes() == (tmp_path / part).read_bytes()
+
+    report = ptl.upload_patron_files([manifest], flaky, state_path)
+    assert report['skipped'] == len(written['parts']) and report['uploaded'] == 0
+
+# ---------------- Startup ---------------- #
+
+def test_headless_import_skips_streamlit_and_polars():
+    probe = (
+        "import sys, patron_loading_transform as ptl; "
+        "ptl.split_report_rows(ptl.build_empty_source_frame()); "
+        "print('streamlit' in sys.modules, 'polars' in sys.modules)"
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', probe], cwd=os.path.dirname(ptl.__file__), capture_output=True, text=True, check=True
+    )
+    assert result.stdout.split() == ['False', 'False']
+
+# ---------------- Stage cache ---------------- #
+
+def test_stage_cache_evicts_least_recently_used_within_budget():
+    frames = {key: pd.DataFrame({'value': [key * 100] * 100}) for key in 'abc'}
+    size = ptl.estimate_cache_bytes(frames['a'])
+    cache = ptl.StageCache(max_bytes=2 * size)
+    cache.put('a', frames['a'], [])
+    cache.put('b', frames['b'], [])
+    assert cache.get('a')[0] is frames['a']
+    cache.put('c', frames['c'], [])
+
+    assert cache.get('b')[0] is ptl._CACHE_MISS
+    assert cache.get('a')[0] is frames['a'] and cache.get('c')[0] is frames['c']
+    assert cache.stats() == {
+        'entries': 2, 'bytes': 2 * size, 'max_bytes': 2 * size, 'hits': 3, 'misses': 1, 'evictions': 1
+    }
+    cache.put('big', pd.concat([frames['a']] * 3), [])
+    assert cache.get('big')[0] is ptl._CACHE_MISS
+
+def test_cached_stage_replays_warnings_and_hands_out_copies(monkeypatch):
+    calls, shown = [], []
+    cache = ptl.StageCache(max_bytes=1 << 20)
+    streamlit = types.SimpleNamespace(runtime=types.SimpleNamespace(exists=lambda: True), warning=shown.append)
+    monkeypatch.setitem(sys.modules, 'streamlit', streamlit)
+    monkeypatch.setattr(ptl, 'get_stage_cache', lambda: cache)
+
+    @ptl.cached_stage
+    def stage(frame):
+        calls.append(len(frame))
+        ptl.show_warning('checked')
+        return frame.assign(done=True)
+
+    frame = pd.DataFrame({'value': [1, 2]})
+    first = stage(frame)
+    first['done'] = False
+    second = stage(frame.copy())
+    assert calls == [2] and shown == ['checked', 'checked']
+    assert second['done'].all()
+    stage(frame.assign(value=[1, 3]))
+    assert calls == [2, 2]
+
+# ---------------- Rejection codes ---------------- #
+
+def test_rejection_codes_record_every_failed_rule():
+    rows = [
+        ('PERSON_ACTIVE', 'PROGRAM_ACTIVE', 'ENROLMENT_ENROLLED', 'Whitley College'),
+        (' PERSON_ACTIVE ', 'PROGRAM_ACTIVE', 'ENROLMENT_ENROLLED', 'Pilgrim Theological College'),
+        ('PERSON_INACTIVE', 'PROGRAM_ACTIVE', 'ENROLMENT_ENROLLED', 'Whitley College'),
+        ('PERSON_ACTIVE', 'PROGRAM_LAPSED', 'ENROLMENT_WITHDRAWN', 'Trinity College Theological School'),
+        ('PERSON_ACTIVE', 'PROGRAM_ACTIVE', 'ENROLMENT_ENROLLED', 'Nowhere College'),
+        (None, 'PROGRAM_ACTIVE', 'ENROLMENT_ENROLLED', ''),
+    ]
+    raw = pd.DataFrame(rows, columns=[
+        'Person Status Id', 'Course Status Id', 'Enrolment Status Id', 'Student Home Institution Name'
+    ])
+    primary, secondary, rejected = ptl.split_report_rows(raw)
+    assert primary.index.tolist() == [0]
+    assert secondary.index.tolist() == [1]
+    assert rejected.index.tolist() == [2, 3, 4, 5]
+    assert rejected[ptl.REJECTION_CODE_COLUMN].tolist() == [1, 6, 8, 9]
+    assert rejected[ptl.REJECTION_REASON_COLUMN].tolist() == [
+        'Person status', 'Course status; Enrolment status', 'Institution group', 'Person status; Institution group'
+    ]
+    assert ptl.count_rejection_reasons(rejected[ptl.REJECTION_CODE_COLUMN]) == {
+        'Person status': 2, 'Course status': 1, 'Enrolment status': 1, 'Institution group': 2, 'Total rejected': 4
+    }
+
+# ---------------- Regression harness ---------------- #
+
+def test_committed_goldens_match():
+    # Timings are machine-dependent; this only holds the output bytes to the goldens.
+    report = ptl.run_regression(ptl.REGRESSION_FIXTURES_DIR, tolerance=float('inf'), repeat=1)
+    assert report['passed'], [entry['outputs'] for entry in report['files']]
+    assert len(report['files']) == len(ptl.list_regression_fixtures(ptl.REGRESSION_FIXTURES_DIR))
+
+def test_regression_reports_a_changed_golden(tmp_path):
+    (tmp_path / 'report_standard.csv').write_bytes(fixture_bytes('report_standard.csv'))
+    assert ptl.run_regression(str(tmp_path), update=True, repeat=1)['passed']
+
+    golden = tmp_path / ptl.REGRESSION_GOLDEN_DIR / 'report_standard_primary.txt'
+    golden.write_bytes(golden.read_bytes().replace(b'Zo\xeb', b'Zoe', 1))
+    report = ptl.run_regression(str(tmp_path), tolerance=float('inf'), repeat=1)
+    assert not report['passed']
+    difference = report['files'][0]['outputs']['primary']
+    assert difference == {'line': 2, 'field': 'givenName'}
+    assert report['files'][0]['outputs']['secondary'] == 'identical'
+
+# ---------------- Transfer picker ---------------- #
+
+def test_transfer_index_matches_word_prefixes():
+    primary = pd.DataFrame({
+        'First Name': ['Jane', 'John', 'Janet', 'Zoë', 'Jane'],
+        'Last Name': ['Smith', 'Smithers', 'Brown', "O'Neil", 'Smith'],
+        'Student Number': ['S1', '', 'S3', 'S4', 'S1'],
+        'Email': ['jane@uni.edu.au', 'john.s@uni.edu.au', '', 'zoe@other.edu.au', 'dup@uni.edu.au']
+    })
+    index = ptl.build_transfer_index(primary)
+    candidates = index[0]
+
+    def labels(query):
+        return candidates['__transfer_label'].iloc[ptl.search_transfer_index(index, query)].tolist()
+
+    assert len(candidates) == 4
+    assert labels('') == candidates['__transfer_label'].tolist()
+    assert labels('smi') == ['Jane Smith [S1]', 'John Smithers [john.s@uni.edu.au]']
+    assert labels('SMITH ja') == ['Jane Smith [S1]']
+    assert labels('zo') == ['Zoë O\'Neil [S4]']
+    assert labels('other') == ['Zoë O\'Neil [S4]']
+    assert labels('nobody') == []
+
+    extended = ptl.extend_transfer_index(index, pd.DataFrame({
+        'First Name': ['Sam'], 'Last Name': ['Smith'], 'Student Number': [''], 'Email': ['']
+    }))
+    found = extended[0].iloc[ptl.search_transfer_index(extended, 'smith')]
+    assert found['__transfer_label'].tolist() == ['Jane Smith [S1]', 'John Smithers [john.s@uni.edu.au]', 'Sam Smith [no id]']
+    assert found['__transfer_id'].iloc[-1].startswith('MN::')
+
+# ---------------- Lineage ---------------- #
+
+def test_lineage_codes_round_trip():
+    rows = np.array([2, 3, (1 << ptl.LINEAGE_ROW_BITS) - 1], dtype=np.int64)
+    file_ids = np.array([0, 7, (1 << ptl.LINEAGE_FILE_BITS) - 1], dtype=np.int64)
+    codes = ptl.encode_lineage(ptl.LINEAGE_SOURCE_TRANSFER, file_ids, rows, ptl.LINEAGE_ACTION_UPDATED)
+    assert codes.dtype == np.int64 and (codes > 0).all()
+
+    sources, decoded_files, decoded_rows, actions = ptl.split_lineage(codes)
+    assert sources.tolist() == [ptl.LINEAGE_SOURCE_TRANSFER] * 3
+    assert decoded_files.tolist() == file_ids.tolist()
+    assert decoded_rows.tolist() == rows.tolist()
+    assert actions.tolist() == [ptl.LINEAGE_ACTION_UPDATED] * 3
+
+    restamped = ptl.restamp_lineage(codes, ptl.LINEAGE_ACTION_ADDED, ptl.LINEAGE_SOURCE_MANUAL)
+    sources, decoded_files, decoded_rows, actions = ptl.split_lineage(restamped)
+    assert sources.tolist() == [ptl.LINEAGE_SOURCE_MANUAL] * 3
+    assert decoded_rows.tolist() == rows.tolist() and decoded_files.tolist() == file_ids.tolist()
+    assert actions.tolist() == [ptl.LINEAGE_ACTION_ADDED] * 3
+
+def test_batch_lineage_points_at_source_lines():
+    files = [(name, fixture_bytes(name)) for name in ['report_standard.csv', 'secondary_audit.csv']]
+    _, merged_secondary, _, report = ptl.run_batch(files, workers=1)
+    lineage = ptl.describe_lineage(merged_secondary[ptl.LINEAGE_COLUMN], report['lineage']['files'])
+    assert set(lineage['Source File']) == {'report_standard.csv', 'secondary_audit.csv'}
+
+    raw = {name: ptl.read_report_bytes(name, data) for name, data in files}
+    for (_, row), (_, origin) in zip(merged_secondary.iterrows(), lineage.iterrows()):
+        # Header is line 1, so data row n is frame row n - 2.
+        source = raw[origin['Source File']].iloc[origin['Source Row'] - 2]
+        if origin['Source File'] == 'report_standard.csv':
+            assert source['Student Number'] == row['Student Number'] or pd.isna(source['Student Number'])
+        else:
+            assert source['Barcode'] == row['Student Number'] or pd.isna(source['Barcode'])